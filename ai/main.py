@@ -1,19 +1,147 @@
 import json
+import logging
+import logging.handlers
 import os
-import tempfile
+import queue
 import secrets
 import asyncio
+import sys
 import time
+import hashlib
+import hmac
+import re
+import shlex
+import signal
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import cache, lru_cache
+from urllib.parse import parse_qsl
 from typing import Callable, Awaitable, Dict, Any, List, Optional
 
 
+logger = logging.getLogger("ai.main")
+chat_logger = logging.getLogger("ai.chat")
+
+# Set the loop policy before voicebot/ is imported so anything bound to a loop at
+# import time already lives on uvloop.
+if sys.platform != "win32":
+    try:
+        import uvloop
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+try:
+    import orjson
+
+    def _json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+    _json_loads = json.loads
+
+
+def _json_text(obj: Any) -> str:
+    """Serialize for websocket text frames (the client only parses JSON from text frames)."""
+    return _json_dumps(obj).decode()
+
+
+_TTS_BYTES_PREFIX = '{"type":"debug","stage":"tts_bytes","bytes":'
+
+
+def _tts_bytes_frame(n: int) -> Dict[str, Any]:
+    """Debug frame with the reply's audio size; only the integer varies, so no JSON encode."""
+    return {"type": "websocket.send", "text": f"{_TTS_BYTES_PREFIX}{n}}}"}
+
+
+def _ws_error(message: str) -> Dict[str, Any]:
+    return {"type": "websocket.send", "text": _json_text({"type": "error", "message": message})}
+
+
+# Static payloads serialized once at import. Websocket send messages pass through
+# the middleware untouched so they can be shared; HTTP start messages cannot
+# (CORS/timing layers replace their header list), so only header tuples and
+# body messages are prebuilt.
+_WS_UNAUTHORIZED = _ws_error("Unauthorized")
+_WS_NO_AAI_KEY = _ws_error("ASSEMBLYAI_API_KEY missing")
+_WS_NO_AUDIO = _ws_error("No audio received")
+_WS_AUDIO_TOO_LARGE = _ws_error("audio too large")
+_WS_UNKNOWN_PATH = _ws_error("Unknown WebSocket path")
+_WS_ACCEPT = {"type": "websocket.accept"}
+_WS_CLOSE_NORMAL = {"type": "websocket.close", "code": 1000}
+_WS_CLOSE_POLICY = {"type": "websocket.close", "code": 1008}
+_WS_CLOSE_TOO_BIG = {"type": "websocket.close", "code": 1009}
+_WS_CLOSE_ERROR = {"type": "websocket.close", "code": 1011}
+_WS_CLOSE_UNAUTHORIZED = {"type": "websocket.close", "code": 4401}
+_HEALTH_BODY = _json_dumps({"status": "ok"})
+_HEALTH_HEADERS = ((b"content-type", b"application/json"), (b"content-length", str(len(_HEALTH_BODY)).encode()))
+_TEXT_REQUIRED_BODY = _json_dumps({"error": "text is required"})
+_JSON_HEADERS = ((b"content-type", b"application/json"),)
+_TEXT_REQUIRED_HEADERS = (*_JSON_HEADERS, (b"content-length", str(len(_TEXT_REQUIRED_BODY)).encode()))
+_TOO_LARGE_BODY = _json_dumps({"error": "text too long"})
+_TOO_LARGE_HEADERS = (*_JSON_HEADERS, (b"content-length", str(len(_TOO_LARGE_BODY)).encode()))
+_OPTIONS_HEADERS = (
+    (b"access-control-allow-methods", b"POST, GET, OPTIONS"),
+    (b"access-control-allow-headers", b"content-type"),
+)
+_NOT_FOUND_BODY = b"Not Found"
+_NOT_FOUND_HEADERS = ((b"content-type", b"text/plain"), (b"content-length", b"9"))
+_EMPTY_BODY = {"type": "http.response.body", "body": b""}
+
+
+def _raise_nofile_limit() -> None:
+    """Lift the soft open-file limit to the hard limit so websocket count isn't capped at ~1024.
+
+    Containers and systemd units may still need ``ulimit -n`` / ``LimitNOFILE=``
+    to raise the hard limit itself.
+    """
+    import resource
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == hard:
+        return
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        return
+    logger.info("RLIMIT_NOFILE soft limit raised %s -> %s", soft, hard)
+
+
+if os.name == "posix":
+    _raise_nofile_limit()
+
 try:
     from voicebot.conversation import transcribe_audio as _transcribe_audio, handle_conversation as _handle_conversation
-    from voicebot.voice_utils import generate_voice as _generate_voice
 except Exception:
     _transcribe_audio = None  
     _handle_conversation = None  
-    _generate_voice = None  
+
+try:
+    from voicebot.voice_utils import synthesize_voice as _synthesize_voice
+except Exception:
+    _synthesize_voice = None
+
+try:
+    from voicebot.voice_utils import generate_voice_stream as _generate_voice_stream
+except Exception:
+    _generate_voice_stream = None
+
+try:
+    import assemblyai as aai
+except Exception:
+    aai = None
+
+try:
+    from klarvia_voice_bot import infer as _kvb_infer
+except Exception:
+    _kvb_infer = None
 
 
 try:
@@ -28,161 +156,998 @@ except Exception:
     monitoring = None
 
 
-try:
-    from openai import OpenAI 
-except Exception:
-    OpenAI = None  
+_ENV_ON = frozenset({"1", "true", "yes", "on"})
+
+
+def _env_flag(name: str, default: str = "") -> bool:
+    return os.getenv(name, default).strip().lower() in _ENV_ON
 
 
 _WS_TOKEN: str = os.getenv("WS_AUTH_TOKEN", "") or secrets.token_urlsafe(16)
+_WS_TOKEN_BYTES = _WS_TOKEN.encode()
+
+# Deployment settings read once; the env doesn't change while the process runs.
+_FAKE_STT = _env_flag("FAKE_STT")
+_AAI_KEY = os.getenv("ASSEMBLYAI_API_KEY") or ""
+_STT_BACKEND = "assemblyai" if (_AAI_KEY or _FAKE_STT) else "file"
+_STT_LANGUAGE = os.getenv("STT_LANGUAGE", "en")
+_KLARVIA_CMD = os.getenv("KLARVIA_MODEL_CMD") or ""
+_KLARVIA_CMD_PERSISTENT = _env_flag("KLARVIA_MODEL_CMD_PERSISTENT")
+# Plain "prog arg ..." commands are exec'd directly; anything using shell syntax
+# (pipes, redirects, variables, globs, comments, a leading VAR=value) and every
+# command on Windows, where CreateProcess has its own quoting rules, still goes
+# through the shell.
+_SHELL_SYNTAX = re.compile(r"[|&;<>()$`*?~{}\[\]!#\n]|^\s*[A-Za-z_]\w*=")
+_KLARVIA_ARGV: Optional[List[str]] = (
+    shlex.split(_KLARVIA_CMD)
+    if _KLARVIA_CMD and os.name == "posix" and not _SHELL_SYNTAX.search(_KLARVIA_CMD)
+    else None
+)
+_AI_CHAT_URL = os.getenv("AI_CHAT_URL") or ""
+_OPENAI_KEY = os.getenv("OPENAI_API_KEY") or ""
+
+# /chat input caps, checked before any backend sees the text.
+_MAX_CHAT_BODY = int(os.getenv("MAX_CHAT_BODY_BYTES", str(64 << 10)))
+_MAX_CHAT_CHARS = int(os.getenv("MAX_CHAT_CHARS", "4000"))
+# Largest clip /ws/audio accepts; also the websocket frame limit when run via uvicorn.
+_MAX_WS_AUDIO = int(os.getenv("MAX_WS_AUDIO_BYTES", str(4 << 20)))
+
+_CONFIG_BODY = _json_dumps({"stt_backend": _STT_BACKEND})
+_CONFIG_HEADERS = ((b"content-type", b"application/json"), (b"content-length", str(len(_CONFIG_BODY)).encode()))
+_WS_TOKEN_BODY = _json_dumps({"token": _WS_TOKEN})
+_WS_TOKEN_HEADERS = ((b"content-type", b"application/json"), (b"content-length", str(len(_WS_TOKEN_BODY)).encode()))
+
+# STT latency / stage timing / TTS byte-count debug frames are only sent when this is set.
+_DEBUG_TIMINGS = _env_flag("KLARVIA_DEBUG_TIMINGS")
+
+# Streaming STT segmentation: silence that closes an utterance, and the longest
+# stretch of continuous speech before a final is forced. Longer flushes give the
+# recognizer more context (lower WER) at the cost of later finals.
+_STT_IDLE_FINAL_MS = int(os.getenv("STT_IDLE_FINAL_MS", "500"))
+# The FAKE_STT emitter keeps its original 300 ms unless STT_IDLE_FINAL_MS is set.
+_FAKE_IDLE_FINAL_MS = int(os.getenv("STT_IDLE_FINAL_MS", "300"))
+# After a stop frame, how long to wait for AssemblyAI's last final.
+_STT_END_WAIT_S = 0.5
+_STT_FLUSH_MS = int(os.getenv("STT_FLUSH_MS", "5000"))
+
+# Start the model on partial transcripts so the reply is often ready when the
+# final lands. Off by default: every speculative call is a full model request,
+# and handle_conversation(allow_stateful=False) only skips the OpenAI history,
+# so AI_CHAT_URL / KLARVIA_MODEL_CMD must be stateless before turning this on.
+# A new call is only started once the partial has grown by _SPEC_MIN_WORDS.
+_SPECULATIVE_REPLY = _env_flag("SPECULATIVE_REPLY")
+_SPEC_MIN_WORDS = max(1, int(os.getenv("SPECULATIVE_MIN_WORDS", "3")))
+_SPEC_STRIP = re.compile(r"[^\w\s]+")
+
+# Control frames exactly as JSON.stringify / json.dumps emit them; anything else
+# that looks like a typed JSON object is still parsed.
+_STOP_FRAMES = frozenset({
+    '{"type":"stop"}', '{"type":"end"}', '{"type": "stop"}', '{"type": "end"}',
+})
+
+
+def _is_stop_frame(text: str) -> bool:
+    if text in _STOP_FRAMES:
+        return True
+    if not text.startswith("{") or '"type"' not in text:
+        return False
+    try:
+        return _json_loads(text).get("type") in ("stop", "end")
+    except Exception:
+        return False
+
+
+# AssemblyAI realtime message types routed by the streaming handler.
+_MT_PARTIAL = sys.intern("PartialTranscript")
+_MT_FINAL = sys.intern("FinalTranscript")
+# Errors meaning the realtime model was retired; the stream then falls back to fake STT.
+_STT_FALLBACK_ERROR = re.compile(r"deprecated|universal.*use|use.*universal", re.IGNORECASE | re.DOTALL)
+
+# Short acknowledgement played when the model has not answered within
+# FILLER_AFTER_MS of the final transcript. FILLER_TEXT= (empty) disables it.
+_FILLER_TEXT = os.getenv("FILLER_TEXT", "Mm-hm.").strip()
+_FILLER_AFTER_S = int(os.getenv("FILLER_AFTER_MS", "200")) / 1000
+
+
+def _spec_key(text: str) -> str:
+    """Casing/punctuation-insensitive form used to match a partial against the final."""
+    return " ".join(_SPEC_STRIP.sub("", text.lower()).split())
+
+_PRODUCTION_ENVS = frozenset({"prod", "production"})
+_DEV_ENVS = frozenset({"", "dev", "development"})
+
+
+@cache
+def _allow_all_cors() -> bool:
+    """Whether CORS reflects any request Origin (resolved once per process).
+
+    ENV=production disables it outright; otherwise ALLOW_ALL_CORS decides,
+    falling back to ENV itself and defaulting on when neither is set.
+    """
+    env = os.environ.get("ENV", "").lower()
+    if env in _PRODUCTION_ENVS:
+        return False
+    return _env_flag("ALLOW_ALL_CORS", "1" if env in _DEV_ENVS else env)
+
+
+@cache
+def _cors_origins() -> Optional[frozenset]:
+    """Origins PermissiveCORS answers for: None reflects any origin (dev).
+
+    Otherwise CORS_ALLOW_ORIGINS (comma separated) lists them; its default ``*``
+    sends ``Access-Control-Allow-Origin: *`` as the server always did.
+    """
+    if _allow_all_cors():
+        return None
+    raw = os.environ.get("CORS_ALLOW_ORIGINS", "*")
+    return frozenset(o.strip().rstrip("/").encode() for o in raw.split(",") if o.strip())
+
+
+def _stage_begin(name: str) -> None:
+    if monitoring is not None:
+        try:
+            monitoring.stage_start(name)
+        except Exception:
+            pass
+
+
+def _stage_finish(name: str, success: bool, msg: str = "") -> None:
+    if monitoring is not None:
+        try:
+            monitoring.stage_end(name, success=success, msg=msg)
+        except Exception:
+            pass
+
+
+class _StageNote:
+    __slots__ = ("msg",)
+
+    def __init__(self):
+        self.msg = ""
 
 
-async def _tts_worker(queue: "asyncio.Queue[Optional[str]]", send_ws, monitoring_mod) -> None:
-    """Background worker: consumes text chunks, synthesizes with ElevenLabs, sends audio bytes."""
+@contextmanager
+def _stage(name: str):
+    """Record a pipeline stage in voicebot.monitoring (no-op without it).
+
+    Set ``.msg`` on the yielded note to annotate success; an exception ends the
+    stage as failed with its text and is re-raised for the caller to handle.
+    """
+    note = _StageNote()
+    _stage_begin(name)
+    try:
+        yield note
+    except Exception as e:
+        _stage_finish(name, False, str(e))
+        raise
+    _stage_finish(name, True, note.msg)
+
+
+# Per-stage pools so a burst of slow ElevenLabs calls can't queue STT or model
+# calls (or the other way round) behind it in asyncio's shared default executor.
+_TTS_EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("TTS_WORKERS", "1")), thread_name_prefix="tts")
+_STT_EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("STT_WORKERS", "2")), thread_name_prefix="stt")
+_LLM_EXEC = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_WORKERS", "4")), thread_name_prefix="llm")
+
+
+def _run_in(executor: ThreadPoolExecutor, fn: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+    return asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+_AUDIO_CHUNK = 64 * 1024
+
+# Stream ElevenLabs audio as it is synthesized; TTS_STREAM=0 goes back to
+# synthesizing the whole clip in memory, then sending it.
+_TTS_STREAM = _env_flag("TTS_STREAM", "1")
+
+
+async def _iter_in(executor: ThreadPoolExecutor, make_iter: Callable[..., Any], *args: Any):
+    """Drive a blocking iterator on ``executor`` and yield its items on the loop.
+
+    Closing the async generator early (client gone) stops the worker at its next item.
+    """
+    loop = asyncio.get_running_loop()
+    items: "asyncio.Queue[Any]" = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def run():
+        try:
+            for item in make_iter(*args):
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(items.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(items.put_nowait, e)
+            return
+        loop.call_soon_threadsafe(items.put_nowait, end)
+
+    worker = loop.run_in_executor(executor, run)
+    try:
+        while True:
+            item = await items.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+    await worker
+
+
+_TTS_CACHE: "OrderedDict[bytes, tuple]" = OrderedDict()
+_TTS_CACHE_SIZE = int(os.getenv("TTS_CACHE_SIZE", "256"))
+
+
+async def _tts_chunks(text: str):
+    """Yield the synthesized audio for ``text``, replaying it from an exact-match LRU when possible.
+
+    Short replies repeat a lot ("Hello!", apologies, the empty-input prompt), so
+    each synthesis is kept as its chunk tuple; TTS_CACHE_SIZE=0 disables the cache.
+    Cache reads and writes never straddle an await, so no lock is needed.
+    Misses stream from ElevenLabs as audio is produced (see _TTS_STREAM).
+    """
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    cached = _TTS_CACHE.get(key)
+    if cached is not None:
+        _TTS_CACHE.move_to_end(key)
+        for chunk in cached:
+            yield chunk
+        return
+
+    chunks = []
+    if _TTS_STREAM and _generate_voice_stream is not None:
+        # Re-frame the stream into _AUDIO_CHUNK pieces (each binary frame is played
+        # as its own blob). If streaming fails before any audio went out, fall
+        # back to whole-clip synthesis below.
+        buf = bytearray()
+        try:
+            async for piece in _iter_in(_TTS_EXEC, _generate_voice_stream, text):
+                buf += piece
+                if len(buf) >= _AUDIO_CHUNK:
+                    chunk = bytes(buf)
+                    buf.clear()
+                    chunks.append(chunk)
+                    yield chunk
+        except Exception as e:
+            if chunks:
+                raise
+            logger.warning("streaming TTS failed, using whole-clip synthesis: %s", e)
+            buf.clear()
+        else:
+            if buf:
+                chunks.append(bytes(buf))
+                yield chunks[-1]
+    if not chunks:
+        # The clip comes back as bytes; there is no shared output file to race on.
+        # Each frame is played as its own MP3 blob, so a typical reply stays one frame.
+        audio = await _run_in(_TTS_EXEC, _synthesize_voice, text)
+        for offset in range(0, len(audio), _AUDIO_CHUNK):
+            chunk = audio[offset:offset + _AUDIO_CHUNK]
+            chunks.append(chunk)
+            yield chunk
+    if _TTS_CACHE_SIZE > 0:
+        _TTS_CACHE[key] = tuple(chunks)
+        while len(_TTS_CACHE) > _TTS_CACHE_SIZE:
+            _TTS_CACHE.popitem(last=False)
+
+
+async def _tts_collect(text: str) -> List[bytes]:
+    return [chunk async for chunk in _tts_chunks(text)]
+
+
+async def _tts_worker(queue: "asyncio.Queue[Optional[str]]", send_ws, gone: Optional["asyncio.Future[None]"] = None) -> int:
+    """Background worker: consumes text chunks, synthesizes with ElevenLabs, sends audio bytes.
+
+    Stops sending once ``gone`` is done (client disconnected); returns the bytes sent.
+    """
+    total = 0
     while True:
         text = await queue.get()
         if text is None:
             queue.task_done()
             break
         try:
-            if not text.strip():
+            if not text.strip() or (gone is not None and gone.done()):
                 continue
-            
-            if monitoring_mod:
-                try:
-                    monitoring_mod.stage_start("TTS_CHUNK")
-                except Exception:
-                    pass
-            
-            out_path = await asyncio.to_thread(_generate_voice, text)  
-            audio_bytes = await asyncio.to_thread(lambda p=out_path: open(p, "rb").read())
-            if audio_bytes:
-                await send_ws({"type": "websocket.send", "bytes": audio_bytes})
-            if monitoring_mod:
-                try:
-                    monitoring_mod.stage_end("TTS_CHUNK", success=True, msg=f"bytes={len(audio_bytes) if audio_bytes else 0}")
-                except Exception:
-                    pass
-        except Exception as e:
-            if monitoring_mod:
-                try:
-                    monitoring_mod.stage_end("TTS_CHUNK", success=False, msg=str(e))
-                except Exception:
-                    pass
+            with _stage("TTS_CHUNK") as st:
+                sent = 0
+                async for chunk in _tts_chunks(text):
+                    if gone is not None and gone.done():
+                        break
+                    await send_ws({"type": "websocket.send", "bytes": chunk})
+                    sent += len(chunk)
+                st.msg = f"bytes={sent}"
+            total += sent
+        except Exception:
+            pass
         finally:
             queue.task_done()
+    return total
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_MIN_SENTENCE = 20
+
+
+def _split_sentences(text: str) -> List[str]:
+    """Split a reply at sentence ends, folding very short pieces ("Sure.") into the next one."""
+    parts: List[str] = []
+    for piece in _SENTENCE_END.split(text.strip()):
+        if parts and len(parts[-1]) < _MIN_SENTENCE:
+            parts[-1] = f"{parts[-1]} {piece}"
+        elif piece:
+            parts.append(piece)
+    return parts
+
+
+async def _speak(reply: str, send_ws, gone: Optional["asyncio.Future[None]"] = None) -> int:
+    """Synthesize ``reply`` sentence by sentence through _tts_worker; returns the bytes sent.
 
+    The first sentence's audio goes out after synthesizing that sentence alone,
+    not the whole reply, and the client queues the clips back to back.
+    """
+    queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    worker = asyncio.create_task(_tts_worker(queue, send_ws, gone))
+    for sentence in _split_sentences(reply):
+        queue.put_nowait(sentence)
+    queue.put_nowait(None)
+    return await worker
 
-async def _read_body(receive) -> bytes:
-    body = b""
-    more = True
-    while more:
+
+async def _read_body(receive, limit: Optional[int] = None) -> Optional[bytes]:
+    """Collect the request body, or None once it exceeds ``limit`` bytes.
+
+    Guard only sees Content-Length, so chunked uploads are capped here as they
+    arrive. A client disconnect ends the body early.
+    """
+    parts = []
+    size = 0
+    while True:
         message = await receive()
         if message["type"] != "http.request":
-            continue
-        body += message.get("body", b"")
-        more = message.get("more_body", False)
-    return body
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        parts.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(parts)
+
+
+_ALLOW_ANY_ORIGIN = (b"access-control-allow-origin", b"*")
+_ANY_ORIGIN = (_ALLOW_ANY_ORIGIN,)
+_PREFLIGHT_ALLOW = (
+    (b"access-control-allow-methods", b"POST, GET, OPTIONS"),
+    (b"access-control-allow-headers", b"content-type"),
+    (b"access-control-max-age", b"600"),
+)
+_CREDENTIALED = (
+    (b"access-control-allow-credentials", b"true"),
+    (b"vary", b"Origin"),
+)
+
+
+@lru_cache(maxsize=64)
+def _origin_headers(origin: Optional[bytes]) -> tuple:
+    """CORS headers for ``origin``; the frontend only ever uses a handful of origins."""
+    if origin is None:
+        return _ANY_ORIGIN
+    return ((b"access-control-allow-origin", origin), *_CREDENTIALED)
+
+
+@lru_cache(maxsize=64)
+def _preflight_headers(origin: Optional[bytes]) -> tuple:
+    return (*_origin_headers(origin), *_PREFLIGHT_ALLOW)
+
+
+class PermissiveCORS:
+    """Pure ASGI CORS layer.
+
+    With ``origins=None`` (dev) it reflects the request Origin (``*`` with
+    credentials is rejected by browsers); otherwise it sends ``*`` when the
+    allow-list contains it, or reflects only listed origins. Preflights are
+    answered directly, headers are appended to ``http.response.start`` in
+    place, and websocket scopes pass through.
+    """
+
+    __slots__ = ("app", "origins")
+
+    def __init__(self, app, origins: Optional[frozenset] = None):
+        self.app = app
+        self.origins = origins
+
+    def _key(self, origin: Optional[bytes]):
+        """The origin to build headers for (None means ``*``), or False if not allowed."""
+        if self.origins is None:
+            return origin
+        if b"*" in self.origins:
+            return None
+        return origin if origin in self.origins else False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
+        origin = None
+        is_preflight = False
+        for k, v in scope["headers"]:
+            if k == b"origin":
+                origin = v
+            elif k == b"access-control-request-method":
+                is_preflight = True
+
+        key = self._key(origin)
+        if key is False:
+            await self.app(scope, receive, send)
+            return
 
-async def app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, Any]]], send: Callable[[Dict[str, Any]], Awaitable[None]]):
-    if scope["type"] == "websocket":
-        path = scope.get("path", "/")
-        query_bytes: bytes = scope.get("query_string", b"") or b""
-        query_str = query_bytes.decode("utf-8", errors="ignore")
-        query: Dict[str, str] = {}
-        if query_str:
-            for part in query_str.split("&"):
-                if not part:
-                    continue
-                if "=" in part:
-                    k, v = part.split("=", 1)
+        if is_preflight and scope["method"] == "OPTIONS":
+            await send({"type": "http.response.start", "status": 204, "headers": _preflight_headers(key)})
+            await send(_EMPTY_BODY)
+            return
+
+        extra = _origin_headers(key)
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *extra]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+def _allowed_hosts() -> Optional[frozenset]:
+    """Hosts accepted by Guard, from ALLOWED_HOSTS (comma separated; ``*`` disables the check).
+
+    Unset means no check, so LAN and container deployments reached by IP or
+    service name keep working; set it to pin the public hostname(s).
+    """
+    raw = os.environ.get("ALLOWED_HOSTS", "*")
+    hosts = frozenset(h.strip().lower().encode() for h in raw.split(",") if h.strip())
+    return None if b"*" in hosts else hosts
+
+
+class Guard:
+    """Outermost pure ASGI filter: rejects unknown Host headers and oversized bodies.
+
+    Both checks come from a single pass over the raw scope headers, and rejects are
+    answered with prebuilt messages before any downstream layer runs.
+    """
+
+    _BAD_HOST_START = {"type": "http.response.start", "status": 400, "headers": [(b"content-type", b"text/plain"), (b"content-length", b"19")]}
+    _BAD_HOST_BODY = {"type": "http.response.body", "body": b"Invalid host header"}
+    _TOO_LARGE_START = {"type": "http.response.start", "status": 413, "headers": [(b"content-type", b"text/plain"), (b"content-length", b"24")]}
+    _TOO_LARGE_BODY = {"type": "http.response.body", "body": b"Request entity too large"}
+    _WS_REJECT = _WS_CLOSE_POLICY
+
+    __slots__ = ("app", "max_body", "allowed_hosts", "_warned")
+
+    def __init__(self, app, max_body: int = 10 << 20, allowed_hosts: Optional[frozenset] = None):
+        self.app = app
+        self.max_body = max_body
+        self.allowed_hosts = allowed_hosts
+        self._warned = False
+
+    async def __call__(self, scope, receive, send):
+        kind = scope["type"]
+        if kind != "http" and kind != "websocket":
+            await self.app(scope, receive, send)
+            return
+
+        host = None
+        length = 0
+        for k, v in scope["headers"]:
+            if k == b"host":
+                host = v
+            elif k == b"content-length":
+                try:
+                    length = int(v)
+                except ValueError:
+                    length = 0
+
+        if self.allowed_hosts is not None:
+            if host is not None:
+                host = host[1:host.find(b"]")] if host.startswith(b"[") else host.partition(b":")[0]
+            if host is None or host.lower() not in self.allowed_hosts:
+                if not self._warned:
+                    self._warned = True
+                    logger.warning(
+                        "Rejected request with Host %r: not in ALLOWED_HOSTS (%s). Further rejections are not logged.",
+                        host, b",".join(sorted(self.allowed_hosts)).decode(),
+                    )
+                if kind == "websocket":
+                    await send(self._WS_REJECT)
                 else:
-                    k, v = part, ""
-                query[k] = v
+                    await send(self._BAD_HOST_START)
+                    await send(self._BAD_HOST_BODY)
+                return
 
-        
-        ws_token: Optional[str] = os.getenv("WS_AUTH_TOKEN", "") or _WS_TOKEN
+        if length > self.max_body and kind == "http":
+            await send(self._TOO_LARGE_START)
+            await send(self._TOO_LARGE_BODY)
+            return
 
-        
-        if ws_token:
-            supplied = query.get("token", "")
-            if supplied != ws_token:
-                await send({"type": "websocket.accept"})
-                await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": "Unauthorized"})})
-                await send({"type": "websocket.close", "code": 4401})
+        await self.app(scope, receive, send)
+
+
+# Keyed on routed paths only (see _ROUTE_PATHS); anything else, including OPTIONS
+# to arbitrary paths, is counted as "<unmatched>" so clients can't grow the map.
+_REQUEST_COUNTS: Counter = Counter()
+
+
+class ResponseTiming:
+    """Pure ASGI layer that stamps ``x-response-time`` and counts responses per path.
+
+    Stands in for uvicorn's access log (disabled): one perf_counter_ns delta and
+    a header append per request instead of a formatted log write. Unmatched paths
+    are counted under a single key so scanners can't grow the counter.
+    """
+
+    __slots__ = ("app",)
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter_ns()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                elapsed = f"{(time.perf_counter_ns() - t0) / 1e6:.2f}ms".encode()
+                message["headers"] = [*message.get("headers", ()), (b"x-response-time", elapsed)]
+                path = scope["path"]
+                _REQUEST_COUNTS[path if path in _ROUTE_PATHS and message["status"] != 404 else "<unmatched>"] += 1
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+class _WSWriter:
+    """Per-socket outbound queue drained by a single writer task.
+
+    The receive loop only enqueues, so a slow client never stalls STT ingestion.
+    When the queue (``maxsize``) is full, ``partial``/``debug`` events are dropped
+    and counted; finals, replies, errors and audio wait for room. After a failed
+    send the writer keeps draining (and discarding) so producers never block.
+    """
+
+    _DROPPABLE = frozenset({"partial", "debug"})
+
+    __slots__ = ("_send", "_queue", "_closed", "dropped", "_task")
+
+    def __init__(self, send, maxsize: int = 64):
+        self._send = send
+        self._queue: "asyncio.Queue[Optional[dict]]" = asyncio.Queue(maxsize)
+        self._closed = False
+        self.dropped = 0
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        failed = False
+        while True:
+            message = await self._queue.get()
+            if message is None:
                 return
+            if failed:
+                continue
+            try:
+                await self._send(message)
+            except Exception:
+                failed = True
 
-        
-        if path == "/ws/audio-stream":
-            await send({"type": "websocket.accept"})
-            
-            fake_stt = False
+    async def post(self, msg: dict):
+        await self.post_frame({"type": "websocket.send", "text": _json_text(msg)}, msg.get("type") in self._DROPPABLE)
+
+    async def post_frame(self, frame: dict, droppable: bool = False):
+        """Queue an already-built ``websocket.send`` message."""
+        if droppable:
+            try:
+                self._queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self.dropped += 1
+        else:
+            await self._queue.put(frame)
+
+    async def send_bytes(self, data: bytes):
+        await self._queue.put({"type": "websocket.send", "bytes": data})
+
+    async def aclose(self):
+        """Flush queued frames and stop the writer; safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        await self._queue.put(None)
+        await self._task
+        if self.dropped:
+            logger.debug("ws writer dropped %d droppable frames", self.dropped)
+
+
+class _ModelProcess:
+    """Long-lived KLARVIA_MODEL_CMD child: one line of text in, one line of reply out.
+
+    Requests are serialized on a lock since the pipe carries one conversation at a
+    time. A child that exits (EOF) is respawned and the request retried once; one
+    that times out is killed so its late answer can't be read as the next reply.
+    """
+
+    __slots__ = ("cmd", "argv", "proc", "lock")
+
+    def __init__(self, cmd: str, argv: Optional[List[str]] = None):
+        self.cmd = cmd
+        self.argv = argv
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        if self.proc is None or self.proc.returncode is not None:
+            pipes = {"stdin": asyncio.subprocess.PIPE, "stdout": asyncio.subprocess.PIPE, "limit": 1 << 20}
+            if os.name == "posix":
+                # Own process group, so close() also kills whatever a shell forked.
+                pipes["start_new_session"] = True
+            if self.argv:
+                self.proc = await asyncio.create_subprocess_exec(*self.argv, **pipes)
+            else:
+                self.proc = await asyncio.create_subprocess_shell(self.cmd, **pipes)
+
+    async def ask(self, text: str, timeout: float = 30.0) -> str:
+        line = " ".join(text.split()).encode() + b"\n"
+        async with self.lock:
+            for _ in range(2):
+                await self.start()
+                try:
+                    self.proc.stdin.write(line)
+                    await self.proc.stdin.drain()
+                    out = await asyncio.wait_for(self.proc.stdout.readline(), timeout)
+                except (BrokenPipeError, ConnectionResetError):
+                    out = b""
+                except asyncio.TimeoutError:
+                    await self.close()
+                    raise
+                if out:
+                    return out.decode().strip()
+                await self.close()
+        return ""
+
+    async def close(self) -> None:
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        # Once the child has been reaped its pid (the group id) may already be
+        # reused, so only signal a child that is still running.
+        if proc.returncode is None:
+            try:
+                if os.name == "posix":
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except ProcessLookupError:
+                # Exited between the check and the signal.
+                pass
+        # Reap the child so it doesn't linger as a zombie.
+        proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), 5.0)
+        except asyncio.TimeoutError:
+            chat_logger.warning("klarvia model cmd did not exit after kill")
+
+
+_MODEL_PROC = _ModelProcess(_KLARVIA_CMD, _KLARVIA_ARGV) if (_KLARVIA_CMD and _KLARVIA_CMD_PERSISTENT) else None
+
+
+async def _await_disconnect(receive) -> None:
+    """Drain inbound messages until the client disconnects.
+
+    Run as a task once a handler has stopped reading, so later stages (TTS) can
+    check ``task.done()`` and skip work for a client that is already gone.
+    """
+    while (await receive())["type"] != "websocket.disconnect":
+        pass
+
+
+def _start_log_listener() -> Optional[tuple]:
+    """Move the root log handlers onto a listener thread behind a QueueHandler.
+
+    Request-path logging then only enqueues a record; formatting and the
+    write to stderr/files happen off the event loop. Uses monitoring.configure()
+    (or a plain basicConfig) first if nothing has set up logging yet. Returns
+    (listener, queue handler) for _stop_log_listener.
+    """
+    root = logging.getLogger()
+    if not root.handlers:
+        if monitoring is not None:
+            monitoring.configure(debug=_DEBUG_TIMINGS)
+        else:
+            logging.basicConfig(level=logging.INFO)
+    handlers = [h for h in root.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    if not handlers:
+        return None
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    for h in handlers:
+        root.removeHandler(h)
+    queue_handler = logging.handlers.QueueHandler(records)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener, queue_handler
+
+
+def _stop_log_listener(started: tuple) -> None:
+    """Flush the listener and put the original handlers back on the root logger."""
+    listener, queue_handler = started
+    listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(queue_handler)
+    for h in listener.handlers:
+        root.addHandler(h)
+
+
+async def _lifespan(receive: Callable[[], Awaitable[Dict[str, Any]]], send: Callable[[Dict[str, Any]], Awaitable[None]]):
+    """Open long-lived outbound clients once per worker and close them on shutdown."""
+    try:
+        from voicebot import conversation
+    except Exception:
+        conversation = None
+    log_listener = None
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            log_listener = _start_log_listener()
+            if conversation is not None:
+                conversation.get_http_session()
+            if _MODEL_PROC is not None:
+                try:
+                    await _MODEL_PROC.start()
+                except Exception as e:
+                    chat_logger.warning("klarvia model cmd failed to start: %s", e)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if conversation is not None:
+                conversation.close_http_session()
+            if _MODEL_PROC is not None:
+                await _MODEL_PROC.close()
+            _TTS_EXEC.shutdown(wait=False, cancel_futures=True)
+            _STT_EXEC.shutdown(wait=False, cancel_futures=True)
+            _LLM_EXEC.shutdown(wait=False, cancel_futures=True)
+            if log_listener is not None:
+                _stop_log_listener(log_listener)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _http_health(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": _HEALTH_HEADERS})
+    await send({"type": "http.response.body", "body": _HEALTH_BODY})
+
+
+async def _http_config(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": _CONFIG_HEADERS})
+    await send({"type": "http.response.body", "body": _CONFIG_BODY})
+
+
+async def _http_metrics(scope, receive, send) -> None:
+    payload = _json_dumps({"requests": dict(_REQUEST_COUNTS)})
+    await send({"type": "http.response.start", "status": 200, "headers": _JSON_HEADERS})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _http_ws_token(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": _WS_TOKEN_HEADERS})
+    await send({"type": "http.response.body", "body": _WS_TOKEN_BODY})
+
+
+async def _http_chat(scope, receive, send) -> None:
+    body = await _read_body(receive, _MAX_CHAT_BODY)
+    if body is None:
+        await send({"type": "http.response.start", "status": 413, "headers": _TOO_LARGE_HEADERS})
+        await send({"type": "http.response.body", "body": _TOO_LARGE_BODY})
+        return
+    try:
+        data = _json_loads(body or b"{}")
+    except Exception:
+        data = {}
+    text = (data.get("text") or "").strip()
+    if len(text) > _MAX_CHAT_CHARS:
+        await send({"type": "http.response.start", "status": 413, "headers": _TOO_LARGE_HEADERS})
+        await send({"type": "http.response.body", "body": _TOO_LARGE_BODY})
+        return
+    
+    try:
+        if _normalize_transcript is not None and text:
+            norm = _normalize_transcript(text)
+            if norm != text and chat_logger.isEnabledFor(logging.DEBUG):
+                chat_logger.debug("normalize: %r -> %r", text, norm)
+            text = norm
+    except Exception:
+        pass
+    if not text:
+        await send({"type": "http.response.start", "status": 400, "headers": _TEXT_REQUIRED_HEADERS})
+        await send({"type": "http.response.body", "body": _TEXT_REQUIRED_BODY})
+        return
+
+    
+    reply = None
+    
+    cmd = _KLARVIA_CMD
+    if _MODEL_PROC is not None:
+        try:
+            reply = await _MODEL_PROC.ask(text) or None
+        except Exception as e:
+            chat_logger.warning("klarvia model cmd failed: %s", e)
+    elif cmd:
+        try:
+            import subprocess
+            p = await _run_in(_LLM_EXEC, lambda: subprocess.run(_KLARVIA_ARGV or cmd, input=text.encode(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=_KLARVIA_ARGV is None, timeout=30))
+            if p.returncode == 0:
+                reply = p.stdout.decode().strip()
+            else:
+                
+                chat_logger.warning("klarvia model cmd error: %s", p.stderr.decode(errors="replace"))
+        except Exception as e:
+            chat_logger.warning("klarvia model cmd failed: %s", e)
+
+     
+    if reply is None:
+        ai_chat_url = _AI_CHAT_URL
+        openai_key = _OPENAI_KEY
+        if (ai_chat_url or openai_key) and _handle_conversation is not None:
             try:
-                import assemblyai as aai  
+                reply = await _run_in(_LLM_EXEC, _handle_conversation, text)
+                if reply:
+                    chat_logger.debug("backend=voicebot.conversation (ai_chat_url=%s, openai=%s)", bool(ai_chat_url), bool(openai_key))
             except Exception as e:
-                aai = None  
+                chat_logger.warning("voicebot.conversation error: %s", e)
+
+    
+    if reply is None and _kvb_infer is not None:
+        try:
+            out = await _run_in(_LLM_EXEC, _kvb_infer, text)
+            if isinstance(out, str):
+                reply = out.strip()
+                if reply:
+                    chat_logger.debug("backend=klarvia_voice_bot.infer")
+        except Exception as e:
+            chat_logger.warning("klarvia_voice_bot.infer error: %s", e)
+
+    
+    if not reply:
+        reply = f"You said: {text}"
+    payload = _json_dumps({"reply": reply})
+    await send({"type": "http.response.start", "status": 200, "headers": _JSON_HEADERS})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _http_options(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 204, "headers": _OPTIONS_HEADERS})
+    await send(_EMPTY_BODY)
+
+
+async def _http_not_found(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 404, "headers": _NOT_FOUND_HEADERS})
+    await send({"type": "http.response.body", "body": _NOT_FOUND_BODY})
+
+
+_HTTP_ROUTES: Dict[tuple, Callable[..., Awaitable[None]]] = {
+    ("GET", "/health"): _http_health,
+    ("GET", "/config"): _http_config,
+    ("GET", "/metrics"): _http_metrics,
+    ("GET", "/ws-token"): _http_ws_token,
+    ("POST", "/chat"): _http_chat,
+}
+_ROUTE_PATHS = frozenset(path for _method, path in _HTTP_ROUTES)
+
+
+async def _app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, Any]]], send: Callable[[Dict[str, Any]], Awaitable[None]]):
+    kind = scope["type"]
+    # HTTP is one table lookup, ahead of any websocket/auth setup; preflights match any path.
+    if kind == "http":
+        method = scope["method"]
+        if method == "OPTIONS":
+            await _http_options(scope, receive, send)
+        else:
+            await _HTTP_ROUTES.get((method, scope["path"]), _http_not_found)(scope, receive, send)
+        return
+    if kind == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if kind == "websocket":
+        path = scope.get("path", "/")
+
+        if _WS_TOKEN_BYTES:
+            query_bytes: bytes = scope.get("query_string", b"") or b""
+            supplied = ""
+            if b"token=" in query_bytes:
+                supplied = next((v for k, v in parse_qsl(query_bytes.decode("latin-1")) if k == "token"), "")
+            if not hmac.compare_digest(supplied.encode(), _WS_TOKEN_BYTES):
+                await send(_WS_ACCEPT)
+                await send(_WS_UNAUTHORIZED)
+                await send(_WS_CLOSE_UNAUTHORIZED)
+                return
+
+        
+        if path == "/ws/audio-stream":
+            await send(_WS_ACCEPT)
             
-            if os.getenv("FAKE_STT", "") in ("1", "true", "True"):
-                fake_stt = True
-                aai = None  
+            fake_stt = _FAKE_STT
 
-            api_key = os.getenv("ASSEMBLYAI_API_KEY") or ""
+            api_key = _AAI_KEY
             if not api_key and not fake_stt:
-                await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": "ASSEMBLYAI_API_KEY missing"})})
-                await send({"type": "websocket.close", "code": 1011})
+                await send(_WS_NO_AAI_KEY)
+                await send(_WS_CLOSE_ERROR)
                 return
             if not fake_stt:
                 aai.settings.api_key = api_key
 
             
-            from queue import Queue, Empty
-            outbound: "Queue[dict]" = Queue()
+            # STT events are handed to the event loop (thread-safe for SDK callbacks)
+            # and forwarded to the writer by a single pump task.
+            loop = asyncio.get_running_loop()
+            outbound: "deque[Optional[dict]]" = deque()
+            outbound_ready = asyncio.Event()
+
+            def _push(msg: Optional[dict]):
+                outbound.append(msg)
+                outbound_ready.set()
+
+            def _emit(msg: dict):
+                loop.call_soon_threadsafe(_push, msg)
 
             
-            t_first_byte: Optional[float] = None
-            t_first_partial: Optional[float] = None
-            t_final_seen: Optional[float] = None
+            t_first_byte: Optional[int] = None
+            t_first_partial: Optional[int] = None
+            t_final_seen: Optional[int] = None
+            # The recognizer has reported a partial that no final has closed yet.
+            open_partial = False
 
             
             fallback_to_fake = False
 
+            def _on_partial(text: str):
+                nonlocal t_first_partial, open_partial
+                if t_first_partial is None:
+                    t_first_partial = time.monotonic_ns()
+                open_partial = True
+                _emit({"type": "partial", "text": text})
+
+            def _on_final(text: str):
+                nonlocal t_final_seen, open_partial
+                t_final_seen = time.monotonic_ns()
+                open_partial = False
+                _emit({"type": "final", "text": text})
+
+            # Called for every recognizer event (10-20 Hz while speaking).
+            _transcript_handler = {_MT_PARTIAL: _on_partial, _MT_FINAL: _on_final}.get
+
             def _on_data(evt: dict):
                 try:
-                    mt = evt.get("message_type")
-                    if mt == "PartialTranscript":
-                        text = (evt.get("text") or "").strip()
+                    handler = _transcript_handler(evt.get("message_type"))
+                    if handler is not None:
+                        text = evt.get("text") or ""
+                        if text and (text[0].isspace() or text[-1].isspace()):
+                            text = text.strip()
                         if text:
-                            nonlocal t_first_partial, t_first_byte
-                            if t_first_partial is None:
-                                t_first_partial = time.time()
-                                try:
-                                    if t_first_byte is not None:
-                                        latency_ms = int((t_first_partial - t_first_byte) * 1000)
-                                        outbound.put({"type": "debug", "stage": "stt_first_partial", "latency_ms": latency_ms})
-                                except Exception:
-                                    pass
-                            outbound.put({"type": "partial", "text": text})
-                    elif mt == "FinalTranscript":
-                        text = (evt.get("text") or "").strip()
-                        if text:
-                            nonlocal t_final_seen
-                            t_final_seen = time.time()
-                            outbound.put({"type": "final", "text": text})
+                            handler(text)
                 except Exception:
                     pass
 
             def _on_error(e: Exception):
                 try:
                     msg = str(e)
-                    outbound.put({"type": "error", "message": msg})
+                    _emit({"type": "error", "message": msg})
                     
                     nonlocal fallback_to_fake
-                    low = msg.lower()
-                    if ("deprecated" in low) or ("universal" in low and "use" in low):
+                    if _STT_FALLBACK_ERROR.search(msg):
                         fallback_to_fake = True
                         try:
-                            outbound.put({"type": "debug", "stage": "stt_fallback", "reason": msg})
+                            _emit({"type": "debug", "stage": "stt_fallback", "reason": msg})
                         except Exception:
                             pass
                 except Exception:
@@ -194,68 +1159,57 @@ async def app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, A
             fake_task = None
             audio_q: "asyncio.Queue[int]" = asyncio.Queue()
             client_done = asyncio.Event()
-            async def _fake_emitter(out_queue: "Queue[dict]", aq: "asyncio.Queue[int]", done_evt: asyncio.Event):
+            async def _fake_emitter(aq: "asyncio.Queue[int]", done_evt: asyncio.Event):
                 nonlocal t_first_partial, t_final_seen, t_first_byte
                 words = ["Hello", "Klarvia", "I", "have", "a", "headache"]
                 built_count = 0
-                ingested_ms = 0.0
-                last_in_ms = 0.0
-                last_bytes_seen = time.time()
-                per_word_ms = 250.0
-                idle_final_ms = 0.3
-                sent_final = False
-
-                def bytes_to_ms(n: int) -> float:
-                    
-                    return (n / 2.0) / 16000.0 * 1000.0
+                ingested_ns = 0
+                last_bytes_seen = time.monotonic_ns()
+                per_word_ns = 250_000_000
+                idle_final_ns = _FAKE_IDLE_FINAL_MS * 1_000_000
+                get_task: Optional[asyncio.Future] = None
+                done_task = asyncio.ensure_future(done_evt.wait())
 
                 try:
-                    while not sent_final:
-                        try:
-                            n = await asyncio.wait_for(aq.get(), timeout=0.05)
-                            if n and n > 0:
-                                ingested_ms += bytes_to_ms(n)
-                                last_in_ms = ingested_ms
-                                last_bytes_seen = time.time()
-                        except asyncio.TimeoutError:
-                            pass
-
-                        
-                        allow = min(int(ingested_ms // per_word_ms), len(words))
+                    while True:
+                        # Block on audio, the client's stop or the idle deadline; no polling.
+                        all_words = built_count >= len(words)
+                        if get_task is None:
+                            get_task = asyncio.ensure_future(aq.get())
+                        waiting = {get_task} if done_task.done() else {get_task, done_task}
+                        timeout = None
+                        if all_words:
+                            timeout = max(0, last_bytes_seen + idle_final_ns - time.monotonic_ns()) / 1e9
+                        done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                        if get_task in done:
+                            n = get_task.result()
+                            get_task = None
+                            if n > 0:
+                                # 16 kHz mono PCM16 = 32000 bytes/s
+                                ingested_ns += n * 1_000_000_000 // 32_000
+                                last_bytes_seen = time.monotonic_ns()
+
+                        allow = min(ingested_ns // per_word_ns, len(words))
                         if allow > built_count:
                             built_count = allow
-                            text = " ".join(words[:built_count])
-                            try:
-                                if t_first_partial is None and t_first_byte is not None:
-                                    t_first_partial = time.time()
-                                    lat_ms = int((t_first_partial - t_first_byte) * 1000)
-                                    out_queue.put({"type": "debug", "stage": "stt_first_partial", "latency_ms": lat_ms})
-                                out_queue.put({"type": "partial", "text": text})
-                            except Exception:
-                                pass
-
-                        
-                        all_words = (built_count >= len(words))
-                        idle = (time.time() - last_bytes_seen) if last_bytes_seen else 0.0
-                        if all_words and (done_evt.is_set() or idle >= idle_final_ms):
-                            final_text = " ".join(words)
-                            try:
-                                t_final_seen = time.time()
-                                out_queue.put({"type": "final", "text": final_text})
-                            except Exception:
-                                pass
-                            sent_final = True
+                            if t_first_partial is None:
+                                t_first_partial = time.monotonic_ns()
+                            _push({"type": "partial", "text": " ".join(words[:built_count])})
+
+                        if built_count >= len(words) and (
+                            done_evt.is_set() or time.monotonic_ns() - last_bytes_seen >= idle_final_ns
+                        ):
+                            t_final_seen = time.monotonic_ns()
+                            _push({"type": "final", "text": " ".join(words)})
                             break
-
-                        
-                        await asyncio.sleep(0.01)
                 except Exception:
-                    
-                    try:
-                        if built_count > 0:
-                            out_queue.put({"type": "final", "text": " ".join(words[:built_count])})
-                    except Exception:
-                        pass
+                    if built_count > 0:
+                        _push({"type": "final", "text": " ".join(words[:built_count])})
+                finally:
+                    for t in (get_task, done_task):
+                        if t is not None and not t.done():
+                            t.cancel()
 
             if not fake_stt:
                 try:
@@ -266,62 +1220,105 @@ async def app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, A
                         "on_error": _on_error,
                     }
                     
-                    try:
-                        _kwargs.update({
-                            "model": "universal-2",
-                            "language_code": os.getenv("STT_LANGUAGE", "en"),
-                        })
-                        rt = aai.RealtimeTranscriber(**_kwargs)  
-                    except TypeError:
-                        
-                        _kwargs.pop("model", None)
-                        _kwargs.pop("language_code", None)
-                        rt = aai.RealtimeTranscriber(**_kwargs)  
+                    _kwargs.update({
+                        "model": "universal-2",
+                        "language_code": _STT_LANGUAGE,
+                        "end_utterance_silence_threshold": _STT_IDLE_FINAL_MS,
+                    })
+                    # Older SDKs reject some of these; shed the least important first
+                    # so the end-of-utterance threshold survives as long as possible.
+                    for _drop in (("model", "language_code"), ("end_utterance_silence_threshold",), None):
+                        try:
+                            rt = aai.RealtimeTranscriber(**_kwargs)
+                            break
+                        except TypeError:
+                            if _drop is None:
+                                raise
+                            for _k in _drop:
+                                _kwargs.pop(_k, None)
+                            logger.debug("RealtimeTranscriber rejected kwargs, retrying without %s", ", ".join(_drop))
                     
                     getattr(rt, "connect", lambda: None)()  
                 except Exception as e:
-                    await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": f"AAI connect failed: {e}"})})
-                    await send({"type": "websocket.close", "code": 1011})
+                    await send({"type": "websocket.send", "text": _json_text({"type": "error", "message": f"AAI connect failed: {e}"})})
+                    await send(_WS_CLOSE_ERROR)
                     return
 
+            writer = _WSWriter(send)
             got_final_text = ""
-            stt_stage = None
-            if monitoring:
-                stt_stage = "STT"
-                try:
-                    monitoring.stage_start(stt_stage)
-                except Exception:
-                    pass
-            try:
-                while True:
-                    
+            unflushed_ms = 0.0
+            spec_task: Optional["asyncio.Future[str]"] = None
+            # Set once the receive loop has ended: done when the client has gone away.
+            gone: Optional["asyncio.Future[None]"] = None
+            spec_key = ""
+            spec_words = 0
+            spec_pending: Optional[str] = None
+
+            def _speculate(text: str):
+                """Run the model on a partial; one call in flight, the newest partial waits its turn."""
+                nonlocal spec_task, spec_key, spec_words, spec_pending
+                if _normalize_transcript is not None:
                     try:
-                        while True:
-                            msg = outbound.get_nowait()
-                            
-                            if msg.get("type") == "final":
-                                final_text = msg.get("text") or ""
-                                
-                                try:
-                                    if _normalize_transcript is not None and final_text:
-                                        norm = _normalize_transcript(final_text)
-                                        if norm != final_text:
-                                            await send({"type": "websocket.send", "text": json.dumps({"type": "debug", "stage": "normalize", "raw": final_text, "normalized": norm})})
-                                        final_text = norm
-                                except Exception:
-                                    pass
-                                got_final_text = final_text or got_final_text
-                                
-                                if monitoring and stt_stage:
-                                    try:
-                                        monitoring.stage_end(stt_stage, success=True, msg=f"len={len(got_final_text)}")
-                                    except Exception:
-                                        pass
-                            await send({"type": "websocket.send", "text": json.dumps(msg)})
-                    except Empty:
+                        text = _normalize_transcript(text)
+                    except Exception:
                         pass
-
-                    
+                key = _spec_key(text)
+                words = len(key.split())
+                if not key or key == spec_key or words < spec_words + _SPEC_MIN_WORDS:
+                    return
+                if spec_task is not None and not spec_task.done():
+                    spec_pending = text
+                    return
+                spec_key, spec_words, spec_pending = key, words, None
+                spec_task = _run_in(_LLM_EXEC, _handle_conversation, text, False)
+                spec_task.add_done_callback(lambda _t: spec_pending and _speculate(spec_pending))
+            _stage_begin("STT")
+
+            async def _pump():
+                """Forward STT events to the writer; a partial superseded by a later queued one is skipped."""
+                nonlocal got_final_text, unflushed_ms
+                closing = False
+                while not closing:
+                    await outbound_ready.wait()
+                    outbound_ready.clear()
+                    batch = list(outbound)
+                    outbound.clear()
+                    last_partial = max((i for i, m in enumerate(batch) if m is not None and m.get("type") == "partial"), default=-1)
+                    for i, msg in enumerate(batch):
+                        if msg is None:
+                            # Still forward anything that was queued alongside the sentinel.
+                            closing = True
+                            continue
+                        kind = msg.get("type")
+                        if kind == "partial":
+                            if i < last_partial:
+                                continue
+                            if _SPECULATIVE_REPLY and _handle_conversation is not None:
+                                _speculate(msg.get("text") or "")
+                        if kind == "final":
+                            unflushed_ms = 0.0
+                            final_text = msg.get("text") or ""
+                            try:
+                                if _normalize_transcript is not None and final_text:
+                                    norm = _normalize_transcript(final_text)
+                                    if norm != final_text:
+                                        await writer.post({"type": "debug", "stage": "normalize", "raw": final_text, "normalized": norm})
+                                    final_text = norm
+                            except Exception:
+                                pass
+                            got_final_text = final_text or got_final_text
+                            _stage_finish("STT", True, f"len={len(got_final_text)}")
+                        await writer.post(msg)
+
+            pump_task = asyncio.create_task(_pump())
+            send_audio = getattr(rt, "send_audio", None)
+            if not callable(send_audio):
+                send_audio = None
+            force_end = getattr(rt, "force_end_utterance", None)
+            if not callable(force_end):
+                force_end = None
+            try:
+                while True:
                     event = None
                     try:
                         event = await receive()
@@ -332,35 +1329,34 @@ async def app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, A
                         continue
 
                     if event["type"] == "websocket.receive":
-                        if event.get("bytes") is not None:
+                        chunk = event.get("bytes")
+                        if chunk is not None:
                             
                             try:
                                 if t_first_byte is None:
-                                    t_first_byte = time.time()
+                                    t_first_byte = time.monotonic_ns()
                                 if fake_stt or fallback_to_fake:
                                     
-                                    try:
-                                        await audio_q.put(len(event["bytes"]))
-                                    except Exception:
-                                        pass
+                                    audio_q.put_nowait(len(chunk))
                                     if not fake_started:
                                         try:
-                                            fake_task = asyncio.create_task(_fake_emitter(outbound, audio_q, client_done))
+                                            fake_task = asyncio.create_task(_fake_emitter(audio_q, client_done))
                                             fake_started = True
                                         except Exception:
                                             pass
-                                else:
-                                    send_audio = getattr(rt, "send_audio", None)
-                                    if callable(send_audio):
-                                        send_audio(event["bytes"]) 
+                                elif send_audio is not None:
+                                    send_audio(chunk)
+                                    # 16 kHz mono PCM16 -> 32 bytes per ms
+                                    unflushed_ms += len(chunk) / 32.0
+                                    if force_end is not None and unflushed_ms >= _STT_FLUSH_MS:
+                                        force_end()
+                                        unflushed_ms = 0.0
                             except Exception:
                                 pass
+                            # Don't keep the frame alive while awaiting the next one.
+                            event = chunk = None
                         elif event.get("text"):
-                            try:
-                                payload = json.loads(event["text"]) if event["text"].startswith("{") else {}
-                            except Exception:
-                                payload = {}
-                            if payload.get("type") in ("stop", "end"):
+                            if _is_stop_frame(event["text"]):
                                 try:
                                     end_fn = getattr(rt, "end", None)
                                     if callable(end_fn):
@@ -377,108 +1373,123 @@ async def app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, A
                             client_done.set()
                         except Exception:
                             pass
+                        gone = loop.create_future()
+                        gone.set_result(None)
                         break
 
+                if gone is None:
+                    gone = asyncio.ensure_future(_await_disconnect(receive))
+
                 if fake_task is not None:
                     try:
                         await asyncio.wait_for(fake_task, timeout=0.75)
                     except Exception:
                         pass
 
-                for _ in range(20):
-                    try:
-                        msg = outbound.get_nowait()
-                        if msg.get("type") == "final":
-                            got_final_text = msg.get("text") or got_final_text
-                        await send({"type": "websocket.send", "text": json.dumps(msg)})
-                    except Empty:
-                        break
+                if not (fake_stt or fallback_to_fake):
+                    # The SDK thread hands the last final over via call_soon_threadsafe,
+                    # possibly after end() has returned: while speech is still open give
+                    # it a bounded moment, then queue the sentinel the same way so it
+                    # lands behind any callbacks already scheduled.
+                    deadline = loop.time() + _STT_END_WAIT_S
+                    while open_partial and not gone.done() and loop.time() < deadline:
+                        await asyncio.sleep(0.02)
+                    loop.call_soon_threadsafe(_push, None)
+                else:
+                    _push(None)
+                await pump_task
+                spec_pending = None
 
                 
                 reply = ""
+                filler_task = None
                 if got_final_text:
-                    model_stage = "Model"
-                    if monitoring:
-                        try:
-                            monitoring.stage_start(model_stage)
-                        except Exception:
-                            pass
-                    
                     if _handle_conversation is not None:
-                        try:
-                            reply = await asyncio.to_thread(_handle_conversation, got_final_text)
-                            reply = reply or ""
-                            if monitoring:
-                                try:
-                                    monitoring.stage_end(model_stage, success=True, msg=f"len={len(reply)} (local-first)")
-                                except Exception:
-                                    pass
-                        except Exception as e:
-                            if monitoring:
+                        # Synthesize (or fetch from cache) the filler while the model runs, so
+                        # it is ready when FILLER_AFTER_MS expires; a reply that lands first
+                        # cancels it unsent.
+                        if _FILLER_TEXT and _synthesize_voice is not None:
+                            filler_task = asyncio.ensure_future(_tts_collect(_FILLER_TEXT))
+
+                        async def _model_reply(text: str) -> str:
+                            if spec_task is not None and spec_key == _spec_key(text):
                                 try:
-                                    monitoring.stage_end(model_stage, success=False, msg=str(e))
+                                    ready = await spec_task
+                                    if ready:
+                                        return ready
                                 except Exception:
                                     pass
-                            reply = ""
-                    
-                    if monitoring:
+                            return await _run_in(_LLM_EXEC, _handle_conversation, text)
+
                         try:
-                            await send({"type": "websocket.send", "text": json.dumps({"type": "debug", "stage": "timings", "data": monitoring.debug_report()})})
+                            with _stage("Model") as st:
+                                model_task = asyncio.ensure_future(_model_reply(got_final_text))
+                                if filler_task is not None:
+                                    done, _ = await asyncio.wait((model_task,), timeout=_FILLER_AFTER_S)
+                                    if done:
+                                        filler_task.cancel()
+                                    else:
+                                        try:
+                                            for chunk in await filler_task:
+                                                await writer.send_bytes(chunk)
+                                        except Exception:
+                                            pass
+                                reply = await model_task or ""
+                                st.msg = f"len={len(reply)} (local-first)"
                         except Exception:
-                            pass
+                            reply = ""
+                        finally:
+                            if filler_task is not None and not filler_task.done():
+                                filler_task.cancel()
                     
-                    try:
-                        if t_first_byte and t_first_partial:
-                            await send({"type": "websocket.send", "text": json.dumps({
+                    if _DEBUG_TIMINGS:
+                        if monitoring:
+                            try:
+                                await writer.post({"type": "debug", "stage": "timings", "data": monitoring.debug_report()})
+                            except Exception:
+                                pass
+                        if t_first_byte is not None and t_first_partial is not None:
+                            await writer.post({
                                 "type": "debug",
                                 "stage": "stt_first_partial",
-                                "latency_ms": int((t_first_partial - t_first_byte) * 1000)
-                            })})
-                        if t_first_byte and t_final_seen:
-                            await send({"type": "websocket.send", "text": json.dumps({
+                                "latency_ms": (t_first_partial - t_first_byte) // 1_000_000,
+                            })
+                        if t_first_byte is not None and t_final_seen is not None:
+                            await writer.post({
                                 "type": "debug",
                                 "stage": "stt_final",
-                                "latency_ms": int((t_final_seen - t_first_byte) * 1000)
-                            })})
-                    except Exception:
-                        pass
+                                "latency_ms": (t_final_seen - t_first_byte) // 1_000_000,
+                            })
                 if not reply and got_final_text:
                     reply = f"You said: {got_final_text}"
-                await send({"type": "websocket.send", "text": json.dumps({"type": "reply", "text": reply})})
+                await writer.post({"type": "reply", "text": reply})
 
-                audio_bytes = b""
-                if reply and _generate_voice is not None:
-                    tts_stage = "TTS"
-                    if monitoring:
-                        try:
-                            monitoring.stage_start(tts_stage)
-                        except Exception:
-                            pass
+                sent_bytes = 0
+                if reply and _synthesize_voice is not None and not gone.done():
                     try:
-                        out_path = await asyncio.to_thread(_generate_voice, reply)
-                        audio_bytes = await asyncio.to_thread(lambda p=out_path: open(p, "rb").read())
-                        if monitoring:
-                            try:
-                                monitoring.stage_end(tts_stage, success=True, msg=f"bytes={len(audio_bytes)}")
-                            except Exception:
-                                pass
-                    except Exception as e:
-                        if monitoring:
-                            try:
-                                monitoring.stage_end(tts_stage, success=False, msg=str(e))
-                            except Exception:
-                                pass
-                        audio_bytes = b""
-                if audio_bytes:
-                    await send({"type": "websocket.send", "bytes": audio_bytes})
+                        with _stage("TTS") as st:
+                            sent_bytes = await _speak(reply, writer.post_frame, gone)
+                            st.msg = f"bytes={sent_bytes}"
+                    except Exception:
+                        pass
+                if sent_bytes and _DEBUG_TIMINGS:
                     try:
-                        await send({"type": "websocket.send", "text": json.dumps({"type": "debug", "stage": "tts_bytes", "bytes": len(audio_bytes)})})
+                        await writer.post_frame(_tts_bytes_frame(sent_bytes), droppable=True)
                     except Exception:
                         pass
 
-                await send({"type": "websocket.close", "code": 1000})
+                await writer.aclose()
+                await send(_WS_CLOSE_NORMAL)
                 return
             finally:
+                if not pump_task.done():
+                    pump_task.cancel()
+                spec_pending = None
+                if spec_task is not None and not spec_task.done():
+                    spec_task.cancel()
+                if gone is not None and not gone.done():
+                    gone.cancel()
+                await writer.aclose()
                 try:
                     if not fake_stt:
                         close_fn = getattr(rt, "close", None)
@@ -489,315 +1500,231 @@ async def app(scope: Dict[str, Any], receive: Callable[[], Awaitable[Dict[str, A
 
         
         if path == "/ws/audio":
-            await send({"type": "websocket.accept"})
+            await send(_WS_ACCEPT)
             
             chunks: List[bytes] = []
-            tmp_path: Optional[str] = None
-            try:
-                while True:
-                    event = await receive()
-                    if event["type"] == "websocket.receive":
-                        if "bytes" in event and event["bytes"] is not None:
-                            chunks.append(event["bytes"]) 
-                            
-                            break
-                        elif "text" in event and event["text"]:
-                            
-                            try:
-                                payload = json.loads(event["text"]) if event["text"].startswith("{") else {}
-                            except Exception:
-                                payload = {}
-                            if payload.get("type") in ("end", "stop"):
-                                break
-                    elif event["type"] == "websocket.disconnect":
+            total = 0
+            while True:
+                event = await receive()
+                if event["type"] == "websocket.receive":
+                    if "bytes" in event and event["bytes"] is not None:
+                        total += len(event["bytes"])
+                        if total > _MAX_WS_AUDIO:
+                            await send(_WS_AUDIO_TOO_LARGE)
+                            await send(_WS_CLOSE_TOO_BIG)
+                            return
+                        chunks.append(event["bytes"]) 
+                        
                         break
+                    elif "text" in event and event["text"]:
+                        if _is_stop_frame(event["text"]):
+                            break
+                elif event["type"] == "websocket.disconnect":
+                    break
 
-                
-                if not chunks:
-                    await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": "No audio received"})})
-                    await send({"type": "websocket.close", "code": 1000})
-                    return
+            
+            if not chunks:
+                await send(_WS_NO_AUDIO)
+                await send(_WS_CLOSE_NORMAL)
+                return
+            gone = asyncio.ensure_future(_await_disconnect(receive))
 
-                
-                fd, tmp_path = tempfile.mkstemp(suffix=".webm")
-                with os.fdopen(fd, "wb") as f:
-                    for c in chunks:
-                        f.write(c)
+            
+            # STT takes the clip in memory; nothing is written to disk.
+            audio = chunks[0] if len(chunks) == 1 else b"".join(chunks)
 
+            
+            transcript = ""
+            if _transcribe_audio is None:
                 
                 transcript = ""
-                if _transcribe_audio is None:
-                    
-                    transcript = ""
-                else:
-                    stt_stage = "STT"
-                    if monitoring:
-                        try:
-                            monitoring.stage_start(stt_stage)
-                        except Exception:
-                            pass
-                    try:
-                        transcript = await asyncio.to_thread(_transcribe_audio, tmp_path)
+            else:
+                try:
+                    with _stage("STT") as st:
+                        transcript = await _run_in(_STT_EXEC, _transcribe_audio, audio)
                         transcript = transcript or ""
-                        if monitoring:
-                            try:
-                                monitoring.stage_end(stt_stage, success=True, msg=f"len={len(transcript)}")
-                            except Exception:
-                                pass
-                    except Exception as e:
-                        transcript = ""
-                        
-                        await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": f"transcription failed: {e}"})})
-                        if monitoring:
-                            try:
-                                monitoring.stage_end(stt_stage, success=False, msg=str(e))
-                            except Exception:
-                                pass
-
-                if transcript:
-                    await send({"type": "websocket.send", "text": json.dumps({"type": "final", "text": transcript})})
-
-                
-                reply = ""
-                if transcript:
-                    model_stage = "Model"
-                    if monitoring:
-                        try:
-                            monitoring.stage_start(model_stage)
-                        except Exception:
-                            pass
-                    if _handle_conversation is not None:
-                        try:
-                            reply = await asyncio.to_thread(_handle_conversation, transcript)
-                            reply = reply or ""
-                            if monitoring:
-                                try:
-                                    monitoring.stage_end(model_stage, success=True, msg=f"len={len(reply)} (local-first)")
-                                except Exception:
-                                    pass
-                        except Exception as e:
-                            if monitoring:
-                                try:
-                                    monitoring.stage_end(model_stage, success=False, msg=str(e))
-                                except Exception:
-                                    pass
-                            reply = ""
-
-                
-                if monitoring:
-                    try:
-                        await send({"type": "websocket.send", "text": json.dumps({"type": "debug", "stage": "timings", "data": monitoring.debug_report()})})
-                    except Exception:
-                        pass
-
-                if not reply and transcript:
-                    reply = f"You said: {transcript}"
-                elif not reply and not transcript:
-                    reply = "I couldn't hear anything. Please try again."
-
-                await send({"type": "websocket.send", "text": json.dumps({"type": "reply", "text": reply})})
+                        st.msg = f"len={len(transcript)}"
+                except Exception as e:
+                    transcript = ""
+                    
+                    await send({"type": "websocket.send", "text": _json_text({"type": "error", "message": f"transcription failed: {e}"})})
 
-                
-                audio_bytes: Optional[bytes] = None
-                if _generate_voice is not None and reply:
-                    tts_stage = "TTS"
-                    if monitoring:
-                        try:
-                            monitoring.stage_start(tts_stage)
-                        except Exception:
-                            pass
-                    try:
-                        out_path = await asyncio.to_thread(_generate_voice, reply)
-                        
-                        audio_bytes = await asyncio.to_thread(lambda p=out_path: open(p, "rb").read())
-                        if monitoring:
-                            try:
-                                monitoring.stage_end(tts_stage, success=True, msg=f"bytes={len(audio_bytes or b'')} ")
-                            except Exception:
-                                pass
-                    except Exception as e:
-                        if monitoring:
-                            try:
-                                monitoring.stage_end(tts_stage, success=False, msg=str(e))
-                            except Exception:
-                                pass
-                        audio_bytes = None
+            if transcript:
+                await send({"type": "websocket.send", "text": _json_text({"type": "final", "text": transcript})})
 
-                if audio_bytes:
-                    await send({"type": "websocket.send", "bytes": audio_bytes})
-                    try:
-                        await send({"type": "websocket.send", "text": json.dumps({"type": "debug", "stage": "tts_bytes", "bytes": len(audio_bytes or b'')})})
-                    except Exception:
-                        pass
+            
+            reply = ""
+            if transcript and _handle_conversation is not None:
+                try:
+                    with _stage("Model") as st:
+                        reply = await _run_in(_LLM_EXEC, _handle_conversation, transcript)
+                        reply = reply or ""
+                        st.msg = f"len={len(reply)} (local-first)"
+                except Exception:
+                    reply = ""
 
-                await send({"type": "websocket.close", "code": 1000})
-                return
-            finally:
+            
+            if monitoring and _DEBUG_TIMINGS:
                 try:
-                    if tmp_path and os.path.exists(tmp_path):
-                        os.remove(tmp_path)
+                    await send({"type": "websocket.send", "text": _json_text({"type": "debug", "stage": "timings", "data": monitoring.debug_report()})})
                 except Exception:
                     pass
 
-        
-        await send({"type": "websocket.accept"})
-        await send({"type": "websocket.send", "text": json.dumps({"type": "error", "message": "Unknown WebSocket path"})})
-        await send({"type": "websocket.close", "code": 1008})
-        return
-
-    
-    if scope["type"] != "http":
-        await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain")]})
-        await send({"type": "http.response.body", "body": b"Not Found"})
-        return
-
-    path = scope.get("path", "/")
-    method = scope.get("method", "GET").upper()
+            if not reply and transcript:
+                reply = f"You said: {transcript}"
+            elif not reply and not transcript:
+                reply = "I couldn't hear anything. Please try again."
 
-    
-    if method == "OPTIONS":
-        await send({
-            "type": "http.response.start",
-            "status": 204,
-            "headers": [
-                (b"access-control-allow-origin", b"*"),
-                (b"access-control-allow-methods", b"POST, GET, OPTIONS"),
-                (b"access-control-allow-headers", b"content-type"),
-            ],
-        })
-        await send({"type": "http.response.body", "body": b""})
-        return
+            await send({"type": "websocket.send", "text": _json_text({"type": "reply", "text": reply})})
 
-    if path == "/health" and method == "GET":
-        payload = json.dumps({"status": "ok"}).encode()
-        await send({
-            "type": "http.response.start",
-            "status": 200,
-            "headers": [
-                (b"content-type", b"application/json"),
-                (b"access-control-allow-origin", b"*"),
-            ],
-        })
-        await send({"type": "http.response.body", "body": payload})
-        return
-
-    if path == "/config" and method == "GET":
-        
-        stt = "assemblyai" if ((os.getenv("ASSEMBLYAI_API_KEY") or "") or (os.getenv("FAKE_STT") in ("1","true","True"))) else "file"
-        payload = json.dumps({"stt_backend": stt}).encode()
-        await send({
-            "type": "http.response.start",
-            "status": 200,
-            "headers": [
-                (b"content-type", b"application/json"),
-                (b"access-control-allow-origin", b"*"),
-            ],
-        })
-        await send({"type": "http.response.body", "body": payload})
-        return
+            
+            sent_bytes = 0
+            if _synthesize_voice is not None and reply and not gone.done():
+                try:
+                    with _stage("TTS") as st:
+                        sent_bytes = await _speak(reply, send, gone)
+                        st.msg = f"bytes={sent_bytes}"
+                except Exception:
+                    pass
 
-    if path == "/ws-token" and method == "GET":
-        token = os.getenv("WS_AUTH_TOKEN", "") or _WS_TOKEN
-        payload = json.dumps({"token": token}).encode()
-        await send({
-            "type": "http.response.start",
-            "status": 200,
-            "headers": [
-                (b"content-type", b"application/json"),
-                (b"access-control-allow-origin", b"*"),
-            ],
-        })
-        await send({"type": "http.response.body", "body": payload})
-        return
+            if sent_bytes and _DEBUG_TIMINGS:
+                try:
+                    await send(_tts_bytes_frame(sent_bytes))
+                except Exception:
+                    pass
 
-    if path == "/chat" and method == "POST":
-        body = await _read_body(receive)
-        try:
-            data = json.loads(body.decode() or "{}")
-        except Exception:
-            data = {}
-        text = (data.get("text") or "").strip()
-        
-        try:
-            if _normalize_transcript is not None and text:
-                norm = _normalize_transcript(text)
-                if norm != text:
-                    print("[ai.chat] normalize:", {"raw": text, "normalized": norm})
-                text = norm
-        except Exception:
-            pass
-        if not text:
-            payload = json.dumps({"error": "text is required"}).encode()
-            await send({
-                "type": "http.response.start",
-                "status": 400,
-                "headers": [(b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")],
-            })
-            await send({"type": "http.response.body", "body": payload})
+            gone.cancel()
+            await send(_WS_CLOSE_NORMAL)
             return
 
         
-        reply = None
-        
-        cmd = os.getenv("KLARVIA_MODEL_CMD")
-        if cmd:
-            try:
-                import subprocess
-                p = subprocess.run(cmd, input=text.encode(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, timeout=30)
-                if p.returncode == 0:
-                    reply = p.stdout.decode().strip()
-                else:
-                    
-                    print("klarvia model cmd error:", p.stderr.decode())
-            except Exception as e:
-                print("klarvia model cmd failed:", e)
-
-         
-        if reply is None:
-            ai_chat_url = os.getenv("AI_CHAT_URL") or ""
-            openai_key = os.getenv("OPENAI_API_KEY") or ""
-            try:
-                
-                if ai_chat_url or openai_key:
-                    from voicebot.conversation import handle_conversation
-                    try:
-                        reply = handle_conversation(text)
-                        if reply:
-                            print("[ai.chat] backend=voicebot.conversation (ai_chat_url=" + str(bool(ai_chat_url)) + ", openai=" + str(bool(openai_key)) + ")")
-                    except Exception as e:
-                        print("voicebot.conversation error:", e)
-            except Exception:
-                pass
-
-        
-        if reply is None:
-            try:
-                import importlib
-                mod = importlib.import_module("klarvia_voice_bot")
-                infer = getattr(mod, "infer", None)
-                if callable(infer):
-                    try:
-                        out = infer(text)
-                        if isinstance(out, str):
-                            reply = out.strip()
-                            if reply:
-                                print("[ai.chat] backend=klarvia_voice_bot.infer")
-                    except Exception as e:
-                        print("klarvia_voice_bot.infer error:", e)
-            except ModuleNotFoundError:
-                pass
-
-        
-        if not reply:
-            reply = f"You said: {text}"
-        payload = json.dumps({"reply": reply}).encode()
-        await send({
-            "type": "http.response.start",
-            "status": 200,
-            "headers": [(b"content-type", b"application/json"), (b"access-control-allow-origin", b"*")],
-        })
-        await send({"type": "http.response.body", "body": payload})
+        await send(_WS_ACCEPT)
+        await send(_WS_UNKNOWN_PATH)
+        await send(_WS_CLOSE_POLICY)
         return
 
-    await send({"type": "http.response.start", "status": 404, "headers": [(b"content-type", b"text/plain"), (b"access-control-allow-origin", b"*") ]})
-    await send({"type": "http.response.body", "body": b"Not Found"})
+    await send({"type": "http.response.start", "status": 404, "headers": _NOT_FOUND_HEADERS})
+    await send({"type": "http.response.body", "body": _NOT_FOUND_BODY})
+
+
+def _build_stack():
+    """Compose the ASGI layers once at import so no request pays for stack assembly."""
+    stack = PermissiveCORS(_app, _cors_origins())
+    stack = ResponseTiming(stack)
+    stack = Guard(
+        stack,
+        max_body=int(os.environ.get("MAX_BODY_BYTES", str(10 << 20))),
+        allowed_hosts=_allowed_hosts(),
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        names = []
+        layer = stack
+        while layer is not None:
+            names.append(getattr(layer, "__name__", type(layer).__name__))
+            layer = getattr(layer, "app", None)
+        logger.debug("ASGI stack: %s", " -> ".join(names))
+    return stack
+
+
+app = _build_stack()
+
+
+def serve_prod() -> None:
+    """Replace this process with gunicorn running uvicorn workers.
+
+    Workers follow the 2n+1 rule for I/O-bound services, capped by MAX_WORKERS.
+    --preload imports the app once in the master before forking, so the
+    generated websocket token is also shared by every worker.
+    """
+    workers = min(2 * (os.cpu_count() or 1) + 1, int(os.environ.get("MAX_WORKERS", "8")))
+    argv = [
+        "gunicorn",
+        "ai.main:app",
+        "-k", "uvicorn_worker.UvicornWorker",
+        "-w", str(workers),
+        "--worker-connections", "1000",
+        "--keep-alive", "5",
+        "--backlog", "4096",
+        "-b", f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8001')}",
+        "--preload",
+    ]
+    if sys.platform.startswith("linux"):
+        argv.append("--reuse-port")
+    os.execvp(argv[0], argv)
+
+
+def _bind_socket(host: str, port: int):
+    """Bind the listening socket ourselves so SO_REUSEPORT can be set (uvicorn has no option for it).
+
+    On Linux several ``python -m ai.main`` processes can then share one port and the
+    kernel spreads accept() across them. Under Kubernetes this is per pod and does
+    not replace pod-level scaling.
+
+    Sharing needs WS_AUTH_TOKEN: otherwise every process mints its own token and a
+    /ws-token answered by one is rejected (4401) by whichever accepts the upgrade.
+    Without it SO_REUSEPORT is left off, so a second process fails to bind.
+    """
+    import socket
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if sys.platform.startswith("linux"):
+        if os.getenv("WS_AUTH_TOKEN"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        else:
+            logger.warning(
+                "WS_AUTH_TOKEN is not set: SO_REUSEPORT disabled, only one process can serve port %d "
+                "(each process would generate its own websocket token)", port,
+            )
+    # Inherited by accepted sockets on Linux; small WS control frames shouldn't wait on Nagle.
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def main() -> None:
+    """Run the service under uvicorn with uvloop + httptools selected explicitly.
+
+    Auto-reload is on unless ENV=production and only watches the Python sources
+    of ``ai/`` and ``voicebot/`` (watchfiles backend); without reload the app
+    object is handed to uvicorn directly so the module is not imported twice.
+    """
+    import uvicorn
+
+    reload = os.environ.get("ENV", "").lower() not in _PRODUCTION_ENVS
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = uvicorn.Config(
+        "ai.main:app" if reload else app,
+        host=os.environ.get("HOST", "127.0.0.1"),
+        port=int(os.environ.get("PORT", "8001")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        ws="websockets",
+        # Audio is already compressed/PCM, so deflate only burns CPU; one utterance
+        # fits well inside 4 MiB.
+        ws_per_message_deflate=False,
+        ws_max_size=_MAX_WS_AUDIO,
+        reload=reload,
+        reload_dirs=[os.path.join(root, d) for d in ("ai", "voicebot")],
+        reload_includes=["*.py"],
+        reload_excludes=["*.pyc", "__pycache__/*", "*.log"],
+        lifespan="on",
+        backlog=4096,
+        access_log=False,
+    )
+    server = uvicorn.Server(config)
+    if config.should_reload:
+        from uvicorn.supervisors import ChangeReload
+
+        ChangeReload(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run(sockets=[_bind_socket(config.host, config.port)])
+
+
+if __name__ == "__main__":
+    if "--prod" in sys.argv[1:]:
+        serve_prod()
+    else:
+        main()
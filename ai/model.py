@@ -3,7 +3,7 @@ from __future__ import annotations
 
 import os
 import logging
-from typing import Optional
+from typing import Iterator, List, Optional
 
 logger = logging.getLogger("ai.model")
 logger.setLevel(logging.INFO)
@@ -15,7 +15,25 @@ _unsloth_model = None
 _unsloth_tokenizer = None
 _unsloth_device = "cpu"
 
-_hf_pipe = None
+_hf_tok = None
+_hf_model = None
+
+_SYSTEM_PROMPT = "You are a warm, empathetic counsellor named Klarvia."
+_EMPTY_REPLY = "I'm here with you. What's on your mind?"
+
+# KV cache of the system prompt, prefilled once at load (see _prefill_system_prompt).
+_sys_ids = None
+_sys_past = None
+
+
+def _generate_kwargs() -> dict:
+    return dict(
+        max_new_tokens=int(os.environ.get("MAX_NEW_TOKENS", "200")),
+        use_cache=True,
+        temperature=float(os.environ.get("TEMPERATURE", "0.7")),
+        top_p=float(os.environ.get("TOP_P", "0.9")),
+        pad_token_id=_unsloth_tokenizer.eos_token_id,
+    )
 
 
 def _try_load_unsloth(model_path: str) -> bool:
@@ -41,19 +59,112 @@ def _try_load_unsloth(model_path: str) -> bool:
         _unsloth_tokenizer = tokenizer
         _unsloth_device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info("Loaded Unsloth model from %s on %s", model_path, _unsloth_device)
+        _prefill_system_prompt()
         return True
     except Exception as e:
         logger.warning("Unsloth load failed: %s", e)
         return False
 
 
+def _prefill_system_prompt() -> None:
+    """Run the fixed system prompt through the model once and keep its KV cache.
+
+    _generate_ids hands generate() a copy of it, so only the user turn is
+    prefilled per request. Any failure just leaves the cache off.
+    """
+    global _sys_ids, _sys_past
+    try:
+        import torch
+
+        ids = _unsloth_tokenizer.apply_chat_template(
+            [{"role": "system", "content": _SYSTEM_PROMPT}],
+            tokenize=True,
+            add_generation_prompt=False,
+            return_tensors="pt",
+        ).to(_unsloth_device)
+        with torch.inference_mode():
+            out = _unsloth_model(input_ids=ids, use_cache=True)
+        _sys_ids, _sys_past = ids, out.past_key_values
+        logger.info("Cached system prompt KV (%d tokens)", ids.shape[1])
+    except Exception as e:
+        _sys_ids = _sys_past = None
+        logger.warning("System prompt prefill failed, generating without it: %s", e)
+
+
+def _system_cache_for(inputs):
+    """Return a private copy of the system-prompt cache if ``inputs`` starts with it."""
+    if _sys_past is None:
+        return None
+    n = _sys_ids.shape[1]
+    if inputs.shape[1] <= n or not bool((inputs[0, :n] == _sys_ids[0]).all()):
+        return None
+    import copy
+
+    # generate() extends the cache in place.
+    return copy.deepcopy(_sys_past)
+
+
+def _chat_ids(text: str):
+    """Tokenize the system prompt plus one user turn, ready for generation."""
+    return _unsloth_tokenizer.apply_chat_template(
+        [{"role": "system", "content": _SYSTEM_PROMPT}, {"role": "user", "content": text}],
+        tokenize=True,
+        add_generation_prompt=True,
+        return_tensors="pt",
+    ).to(_unsloth_device)
+
+
+def _generate_ids(inputs, **overrides):
+    """Run generate() on chat ``inputs`` and return only the new token ids.
+
+    When ``inputs`` starts with the cached system prompt only the uncached
+    suffix is passed, with an explicit cache_position and a full-length
+    attention mask, so prepare_inputs_for_generation can't take it for a
+    single decode step. If that call fails it is retried once without the
+    cache and the cache is switched off.
+    """
+    global _sys_ids, _sys_past
+    import torch
+
+    kwargs = _generate_kwargs()
+    kwargs.update(overrides)
+    past = _system_cache_for(inputs)
+    if past is not None:
+        n = _sys_ids.shape[1]
+        suffix = inputs[:, n:]
+        try:
+            out = _unsloth_model.generate(
+                input_ids=suffix,
+                attention_mask=torch.ones_like(inputs),
+                past_key_values=past,
+                cache_position=torch.arange(n, inputs.shape[1], device=inputs.device),
+                **kwargs,
+            )
+            return out[0, suffix.shape[1]:]
+        except Exception as e:
+            logger.warning("Cached generate failed, disabling the system prompt cache: %s", e)
+            _sys_ids = _sys_past = None
+            streamer = kwargs.get("streamer")
+            if streamer is not None:
+                # The suffix was already handed to the streamer as the prompt.
+                streamer.next_tokens_are_prompt = True
+    out = _unsloth_model.generate(input_ids=inputs, **kwargs)
+    return out[0, inputs.shape[1]:]
+
+
 def _try_load_transformers(model_name: str) -> bool:
     try:
-        from transformers import pipeline
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        import torch
 
-        global _hf_pipe
-        _hf_pipe = pipeline("text-generation", model=model_name)
-        logger.info("Loaded transformers pipeline: %s", model_name)
+        global _hf_tok, _hf_model
+        cuda = torch.cuda.is_available()
+        _hf_tok = AutoTokenizer.from_pretrained(model_name)
+        _hf_model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.bfloat16 if cuda else torch.float32,
+        ).to("cuda" if cuda else "cpu").eval()
+        logger.info("Loaded transformers model: %s on %s", model_name, _hf_model.device)
         return True
     except Exception as e:
         logger.warning("Transformers load failed: %s", e)
@@ -112,41 +223,29 @@ def get_reply(user_input: str) -> str:
 
     if _strategy == "unsloth":
         assert _unsloth_model is not None and _unsloth_tokenizer is not None
-        history = [
-            {"role": "system", "content": "You are a warm, empathetic counsellor named Klarvia."},
-            {"role": "user", "content": text},
-        ]
-        inputs = _unsloth_tokenizer.apply_chat_template(
-            history,
-            tokenize=True,
-            add_generation_prompt=True,
-            return_tensors="pt",
-        )
         try:
-            import torch
-
-            inputs = inputs.to(_unsloth_device)
-            outputs = _unsloth_model.generate(
-                input_ids=inputs,
-                max_new_tokens=int(os.environ.get("MAX_NEW_TOKENS", "200")),
-                use_cache=True,
-                temperature=float(os.environ.get("TEMPERATURE", "0.7")),
-                top_p=float(os.environ.get("TOP_P", "0.9")),
-                pad_token_id=_unsloth_tokenizer.eos_token_id,
-            )
-            assistant_ids = outputs[0, inputs.shape[1]:]
+            assistant_ids = _generate_ids(_chat_ids(text))
             reply = _unsloth_tokenizer.decode(assistant_ids, skip_special_tokens=True).strip()
-            return reply or "I'm here with you. What's on your mind?"
+            return reply or _EMPTY_REPLY
         except Exception as e:
             logger.error("Unsloth inference error: %s", e)
             return _rule_based_reply(text)
 
     if _strategy == "transformers":
         try:
-            assert _hf_pipe is not None
-            out = _hf_pipe(text, max_new_tokens=int(os.environ.get("MAX_NEW_TOKENS", "60")))
-            gen = out[0].get("generated_text", "").strip()
-            reply = gen[len(text):].strip() if gen.startswith(text) else gen
+            assert _hf_tok is not None and _hf_model is not None
+            import torch
+
+            ids = _hf_tok(text, return_tensors="pt").input_ids.to(_hf_model.device)
+            with torch.inference_mode():
+                out = _hf_model.generate(
+                    ids,
+                    max_new_tokens=int(os.environ.get("MAX_NEW_TOKENS", "60")),
+                    do_sample=False,
+                    use_cache=True,
+                    pad_token_id=_hf_tok.eos_token_id,
+                )
+            reply = _hf_tok.decode(out[0, ids.shape[1]:], skip_special_tokens=True).strip()
             return reply or _rule_based_reply(text)
         except Exception as e:
             logger.error("Transformers inference error: %s", e)
@@ -155,6 +254,93 @@ def get_reply(user_input: str) -> str:
     return _rule_based_reply(text)
 
 
+def get_reply_stream(user_input: str) -> Iterator[str]:
+    """Yield the reply for ``user_input`` as it is decoded.
+
+    With the Unsloth strategy generate() runs on a helper thread feeding a
+    TextIteratorStreamer; other strategies yield the whole get_reply() result.
+    """
+    _load_once()
+
+    text = user_input.strip() if isinstance(user_input, str) else ""
+    if _strategy != "unsloth" or not text:
+        yield get_reply(user_input)
+        return
+
+    import threading
+    from transformers import TextIteratorStreamer
+
+    inputs = _chat_ids(text)
+    streamer = TextIteratorStreamer(_unsloth_tokenizer, skip_prompt=True, skip_special_tokens=True)
+    failed = []
+
+    def _generate():
+        try:
+            _generate_ids(inputs, streamer=streamer)
+        except Exception as e:
+            failed.append(e)
+            streamer.end()
+
+    worker = threading.Thread(target=_generate, name="generate", daemon=True)
+    worker.start()
+    produced = False
+    for piece in streamer:
+        if piece:
+            produced = True
+            yield piece
+    worker.join()
+    if failed:
+        logger.error("Unsloth streaming inference error: %s", failed[0])
+        if not produced:
+            yield _rule_based_reply(text)
+    elif not produced:
+        yield _EMPTY_REPLY
+
+
+def get_replies(user_inputs: List[str]) -> List[str]:
+    """Generate replies for several inputs at once.
+
+    With the Unsloth strategy the prompts are left-padded into one batch and
+    decoded by a single generate() call; other strategies answer one by one.
+    """
+    _load_once()
+
+    texts = [t.strip() if isinstance(t, str) else "" for t in user_inputs]
+    batch = [i for i, t in enumerate(texts) if t]
+    if _strategy != "unsloth" or len(batch) < 2:
+        return [get_reply(t) for t in user_inputs]
+
+    replies = ["" if texts[i] else get_reply(t) for i, t in enumerate(user_inputs)]
+    tok = _unsloth_tokenizer
+    prompts = [
+        tok.apply_chat_template(
+            [{"role": "system", "content": _SYSTEM_PROMPT}, {"role": "user", "content": texts[i]}],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+        for i in batch
+    ]
+    # Left padding is only right for this batch; single-prompt calls share the tokenizer.
+    padding_side = tok.padding_side
+    try:
+        tok.padding_side = "left"
+        if tok.pad_token is None:
+            tok.pad_token = tok.eos_token
+        enc = tok(prompts, return_tensors="pt", padding=True, add_special_tokens=False).to(_unsloth_device)
+        outputs = _unsloth_model.generate(**enc, **_generate_kwargs())
+        width = enc["input_ids"].shape[1]
+        for i, row in zip(batch, outputs):
+            reply = tok.decode(row[width:], skip_special_tokens=True).strip()
+            replies[i] = reply or _EMPTY_REPLY
+    except Exception as e:
+        logger.error("Unsloth batch inference error: %s", e)
+        for i in batch:
+            replies[i] = _rule_based_reply(texts[i])
+    finally:
+        tok.padding_side = padding_side
+    return replies
+
+
 def _rule_based_reply(text: str) -> str:
     lower = text.lower()
     if any(k in lower for k in ["hi", "hello", "hey"]):
@@ -7,16 +7,22 @@ from __future__ import annotations
 
 import logging
 import asyncio
+import base64
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from .model import get_reply, inference_ready
+from .model import get_replies, get_reply_stream, inference_ready
 from .stt import transcribe_audio
 from .tts import text_to_speech
+import hmac
 import os
-import json
+import orjson
 
 load_dotenv()
 
@@ -24,7 +30,138 @@ load_dotenv()
 logger = logging.getLogger("ai.server")
 logger.setLevel(logging.INFO)
 
-app = FastAPI(title="Klarvia AI Chat Service")
+# Encoded once; compared with hmac.compare_digest so the check takes the same time
+# however much of a wrong token matches.
+_WS_AUTH_TOKEN = os.environ.get("WS_AUTH_TOKEN", "").encode()
+
+# get_reply drives a single loaded model; one thread keeps it warm and serializes
+# /chat and websocket callers instead of running it concurrently.
+_LLM_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm")
+
+
+class _ReplyBatcher:
+    """Coalesce replies requested within a few ms of each other into one get_replies() call.
+
+    The first request opens a window of MODEL_BATCH_WAIT_MS; everything queued
+    by then (up to MODEL_MAX_BATCH) is generated together on the model thread.
+    """
+
+    def __init__(self, max_batch: int, wait_s: float):
+        self.max_batch = max(1, max_batch)
+        self.wait_s = wait_s
+        # Both belong to the serving loop, so they are made there (start()), not at import.
+        self._queue: "asyncio.Queue[tuple] | None" = None
+        self._task: "asyncio.Task | None" = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, text: str) -> str:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self.start()
+        fut = loop.create_future()
+        self._queue.put_nowait((text, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.wait_s
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                replies = await loop.run_in_executor(_LLM_EXEC, get_replies, [text for text, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), reply in zip(batch, replies):
+                if not fut.done():
+                    fut.set_result(reply)
+
+
+_replies = _ReplyBatcher(
+    int(os.environ.get("MODEL_MAX_BATCH", "8")),
+    int(os.environ.get("MODEL_BATCH_WAIT_MS", "20")) / 1000,
+)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _pump_reply(text: str, loop: asyncio.AbstractEventLoop, queue: "asyncio.Queue") -> None:
+    """Forward get_reply_stream pieces to ``queue`` (runs on the model thread); None marks the end."""
+    try:
+        for piece in get_reply_stream(text):
+            loop.call_soon_threadsafe(queue.put_nowait, piece)
+    finally:
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+
+async def _stream_reply(websocket: WebSocket, text: str) -> tuple:
+    """Speak the reply sentence by sentence while the model is still decoding.
+
+    Each finished sentence goes out as a reply_delta frame followed by its audio.
+    The client concatenates deltas as-is, so every one after the first carries
+    the space the sentence split consumed. Returns (full reply text, audio bytes sent).
+    """
+    loop = asyncio.get_running_loop()
+    queue: "asyncio.Queue" = asyncio.Queue()
+    producer = loop.run_in_executor(_LLM_EXEC, _pump_reply, text, loop, queue)
+    parts = []
+    pending = ""
+    sent = 0
+    sep = ""
+
+    async def speak(sentence: str) -> None:
+        nonlocal sent, sep
+        sentence = sentence.strip()
+        if not sentence:
+            return
+        await websocket.send_text(orjson.dumps({"type": "reply_delta", "text": sep + sentence}).decode())
+        sep = " "
+        audio = await text_to_speech(sentence)
+        if audio:
+            await websocket.send_bytes(audio)
+            sent += len(audio)
+
+    while (piece := await queue.get()) is not None:
+        parts.append(piece)
+        *done, pending = _SENTENCE_END.split(pending + piece)
+        for sentence in done:
+            await speak(sentence)
+    await speak(pending)
+    await producer
+    return "".join(parts).strip(), sent
+
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    _replies.start()
+    try:
+        yield
+    finally:
+        await _replies.stop()
+
+
+app = FastAPI(title="Klarvia AI Chat Service", default_response_class=ORJSONResponse, lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,13 +191,13 @@ def health():
 
 
 @app.post("/chat", response_model=ChatOut)
-def chat(body: ChatIn):
+async def chat(body: ChatIn):
     try:
         user_text = (body.text or "").strip()
         logger.info("[chat] recv: %s", user_text)
         if not user_text:
             raise HTTPException(status_code=400, detail="text is required")
-        reply = get_reply(user_text)
+        reply = await _replies.submit(user_text)
         logger.info("[chat] reply: %s", reply)
         return ChatOut(reply=reply)
     except HTTPException:
@@ -72,17 +209,17 @@ def chat(body: ChatIn):
 
 @app.websocket("/ws/audio")
 async def ws_audio(websocket: WebSocket):
-    """WebSocket pipeline: base64 audio -> STT -> model -> TTS -> audio bytes.
+    """WebSocket pipeline: WAV audio (binary frame) -> STT -> model -> TTS -> audio bytes.
+
+    Base64 text frames are still decoded for older clients.
     
     Authentication: requires ?token=XYZ query parameter.
     Set WS_AUTH_TOKEN environment variable to enable token verification.
     If WS_AUTH_TOKEN is not set, accepts all connections (dev mode).
     """
-    expected_token = os.environ.get("WS_AUTH_TOKEN")
-    if expected_token:
-        query_params = dict(websocket.query_params)
-        provided_token = query_params.get("token")
-        if not provided_token or provided_token != expected_token:
+    if _WS_AUTH_TOKEN:
+        provided_token = websocket.query_params.get("token") or ""
+        if not hmac.compare_digest(provided_token.encode(), _WS_AUTH_TOKEN):
             logger.warning("/ws/audio rejected: invalid or missing token")
             await websocket.close(code=1008, reason="Unauthorized")
             return
@@ -91,17 +228,20 @@ async def ws_audio(websocket: WebSocket):
     logger.info("/ws/audio connected")
     try:
         while True:
-            b64_chunk = await websocket.receive_text()
-            if not b64_chunk:
-                continue
-
-            import base64
-            try:
-                audio_bytes = base64.b64decode(b64_chunk)
-            except Exception as e:
-                logger.warning("Invalid base64 chunk: %s", e)
-                await websocket.send_text("error: invalid-audio")
-                continue
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            audio_bytes = message.get("bytes")
+            if not audio_bytes:
+                b64_chunk = message.get("text")
+                if not b64_chunk:
+                    continue
+                try:
+                    audio_bytes = base64.b64decode(b64_chunk)
+                except Exception as e:
+                    logger.warning("Invalid base64 chunk: %s", e)
+                    await websocket.send_text("error: invalid-audio")
+                    continue
 
             logger.info("[ws] Received audio (%d bytes)", len(audio_bytes))
             
@@ -111,30 +251,27 @@ async def ws_audio(websocket: WebSocket):
                 continue
             logger.info("[ws] Transcribed text: %s", text)
             try:
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(orjson.dumps({
                     "type": "transcript",
                     "transcript": text,
-                }))
+                }).decode())
             except Exception:
                 pass
 
-            reply_text = await asyncio.to_thread(get_reply, text)
+            reply_text, sent = await _stream_reply(websocket, text)
             logger.info("[ws] Predicted reply: %s", reply_text)
             try:
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(orjson.dumps({
                     "type": "reply",
                     "reply": reply_text,
-                }))
+                }).decode())
             except Exception:
                 pass
 
-            audio_out = await text_to_speech(reply_text)
-            if not audio_out:
+            if not sent:
                 await websocket.send_text("error: tts-failed")
                 continue
-
-            await websocket.send_bytes(audio_out)
-            logger.info("[ws] Sent audio (%d bytes)", len(audio_out))
+            logger.info("[ws] Sent audio (%d bytes)", sent)
 
     except WebSocketDisconnect:
         logger.info("/ws/audio disconnected")
@@ -153,3 +290,26 @@ def config():
         "tts_backend": os.environ.get("TTS_BACKEND"),
         "model_path": os.environ.get("MODEL_PATH"),
     }
+
+
+def _check_pure_asgi_middleware() -> None:
+    """Refuse BaseHTTPMiddleware subclasses: they buffer every response through an extra task.
+
+    Fails at import in development, only warns under ENV=production.
+    """
+    from starlette.middleware.base import BaseHTTPMiddleware
+
+    offenders = [m.cls.__name__ for m in app.user_middleware if isinstance(m.cls, type) and issubclass(m.cls, BaseHTTPMiddleware)]
+    if not offenders:
+        return
+    msg = f"Use pure ASGI middleware instead of BaseHTTPMiddleware: {', '.join(offenders)}"
+    if os.environ.get("ENV", "").lower() in ("prod", "production"):
+        logger.warning(msg)
+    else:
+        raise RuntimeError(msg)
+
+
+_check_pure_asgi_middleware()
+
+# Build Starlette's middleware stack now rather than on the first request/upgrade.
+app.middleware_stack = app.build_middleware_stack()
@@ -3,8 +3,10 @@
 Function: transcribe_audio(audio_bytes) -> str
 - Decodes received WAV bytes in-memory (avoids ffmpeg dependency)
 - Ensures mono float32 audio at 16 kHz
-- Loads Whisper model (default: base) lazily
-- Runs blocking transcribe in a worker thread using asyncio.to_thread
+- Loads Whisper model (default: base) lazily; faster-whisper (CTranslate2, int8)
+  when installed, else the reference openai-whisper package
+- Runs blocking transcribe on a single dedicated worker thread, so concurrent
+  clients queue for the one warm model instead of re-entering it
 """
 
 from __future__ import annotations
@@ -13,24 +15,46 @@ import asyncio
 import logging
 import os
 import io
+import math
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 import numpy as np
 
+try:
+    from scipy.signal import resample_poly
+except ImportError:  # scipy is optional; fall back to linear interpolation
+    resample_poly = None
+
 logger = logging.getLogger("ai.stt")
 
 _whisper_model = None
+_whisper_fast = False
+
+_STT_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stt")
 
 
 def _get_whisper_model():
     """Load and cache the Whisper model (blocking)."""
-    global _whisper_model
+    global _whisper_model, _whisper_fast
     if _whisper_model is not None:
         return _whisper_model
-    import whisper
 
     model_name = os.environ.get("WHISPER_MODEL", "base")
-    logger.info("Loading Whisper model: %s", model_name)
-    _whisper_model = whisper.load_model(model_name)
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError:
+        WhisperModel = None
+    if WhisperModel is not None:
+        device = os.environ.get("WHISPER_DEVICE", "cpu")
+        compute_type = os.environ.get("WHISPER_COMPUTE", "int8")
+        logger.info("Loading faster-whisper model: %s (%s, %s)", model_name, device, compute_type)
+        _whisper_model = WhisperModel(model_name, device=device, compute_type=compute_type)
+        _whisper_fast = True
+    else:
+        import whisper
+
+        logger.info("Loading Whisper model: %s", model_name)
+        _whisper_model = whisper.load_model(model_name)
     logger.info("Whisper model ready")
     return _whisper_model
 
@@ -46,19 +70,23 @@ def _decode_wav_to_16k_mono_float32(data: bytes) -> Optional[np.ndarray]:
 
         with io.BytesIO(data) as bio:
             audio, sr = sf.read(bio, dtype="float32", always_2d=True)
-        if audio.ndim == 2 and audio.shape[1] > 1:
-            audio = np.mean(audio, axis=1)
+        if audio.shape[1] > 1:
+            audio = audio.mean(axis=1, dtype=np.float32)
         else:
             audio = audio.reshape(-1)
 
         target_sr = 16000
         if sr != target_sr:
-            x = np.arange(len(audio), dtype=np.float64)
-            new_len = int(round(len(audio) * (target_sr / float(sr))))
-            xp = np.linspace(0, len(audio) - 1, num=new_len, dtype=np.float64)
-            audio = np.interp(xp, x, audio).astype(np.float32)
-
-        return audio.astype(np.float32)
+            if resample_poly is not None:
+                # Polyphase FIR: anti-aliased, and no float64 index ramps to build.
+                g = math.gcd(int(sr), target_sr)
+                audio = resample_poly(audio, target_sr // g, int(sr) // g)
+            else:
+                new_len = int(round(len(audio) * (target_sr / float(sr))))
+                xp = np.linspace(0, len(audio) - 1, num=new_len, dtype=np.float32)
+                audio = np.interp(xp, np.arange(len(audio), dtype=np.float32), audio)
+
+        return audio.astype(np.float32, copy=False)
     except Exception as e:
         logger.exception("WAV decode/resample failed: %s", e)
         return None
@@ -67,8 +95,8 @@ def _decode_wav_to_16k_mono_float32(data: bytes) -> Optional[np.ndarray]:
 async def transcribe_audio(audio_bytes: bytes) -> str:
     """Asynchronously transcribe audio bytes to text using Whisper.
 
-    Offloads the blocking transcribe() call to a worker thread with
-    asyncio.to_thread to keep the event loop responsive.
+    Offloads the blocking transcribe() call to the STT worker thread to keep
+    the event loop responsive.
     """
     if not audio_bytes:
         return ""
@@ -81,13 +109,17 @@ async def transcribe_audio(audio_bytes: bytes) -> str:
                 return ""
 
             model = _get_whisper_model()
-            result = model.transcribe(audio, fp16=False)
-            raw_text = result.get("text")
-            text = raw_text.strip() if isinstance(raw_text, str) else ""
+            if _whisper_fast:
+                segments, _info = model.transcribe(audio, vad_filter=True, beam_size=1)
+                text = "".join(seg.text for seg in segments).strip()
+            else:
+                result = model.transcribe(audio, fp16=False)
+                raw_text = result.get("text")
+                text = raw_text.strip() if isinstance(raw_text, str) else ""
             logger.info("STT transcription: %s", text)
             return text
         except Exception as e:
             logger.exception("STT error: %s", e)
             return ""
 
-    return await asyncio.to_thread(_do_transcribe, audio_bytes)
+    return await asyncio.get_running_loop().run_in_executor(_STT_EXEC, _do_transcribe, audio_bytes)
@@ -9,34 +9,48 @@ Function `text_to_speech(text)` returns bytes containing WAV audio.
 from __future__ import annotations
 
 import os
+import asyncio
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 logger = logging.getLogger("ai.tts")
 
 TTS_BACKEND = os.environ.get("TTS_BACKEND", "fallback").lower()
 
+# pyttsx3 drivers (SAPI/COM in particular) are bound to the thread that created
+# them, so the engine is created once and only ever used from this one thread;
+# that also serializes concurrent requests onto it.
+_PYTTSX3_EXEC = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyttsx3")
+_engine = None
+_out_path = os.path.join(tempfile.gettempdir(), f"klarvia-tts-{os.getpid()}.wav")
+
+
+def _pyttsx3_synthesize(text: str) -> bytes:
+    """Render ``text`` to WAV bytes with the cached engine (runs on _PYTTSX3_EXEC)."""
+    global _engine
+    if _engine is None:
+        import pyttsx3
+
+        _engine = pyttsx3.init()
+    # The driver can only write to a path; one file per process, overwritten each call.
+    try:
+        _engine.save_to_file(text, _out_path)
+        _engine.runAndWait()
+    except Exception:
+        _engine = None  # re-initialize on the next call
+        raise
+    with open(_out_path, "rb") as f:
+        return f.read()
+
 
 async def text_to_speech(text: str) -> bytes:
     logger.info("TTS backend: %s | text=%s", TTS_BACKEND, text[:40])
 
     if TTS_BACKEND == "pyttsx3":
         try:
-            import pyttsx3
-            import tempfile
-            import os as _os
-
-            engine = pyttsx3.init()
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-                tmp_path = f.name
-            engine.save_to_file(text, tmp_path)
-            engine.runAndWait()
-            with open(tmp_path, "rb") as f:
-                data = f.read()
-            try:
-                _os.unlink(tmp_path)
-            except Exception:
-                pass
+            data = await asyncio.get_running_loop().run_in_executor(_PYTTSX3_EXEC, _pyttsx3_synthesize, text)
             logger.info("pyttsx3 generated %d bytes", len(data))
             return data
         except Exception as e:
@@ -6,7 +6,8 @@ Provides:
 
 Behavior:
 - If the environment variable KLARVIA_MODEL_CMD is set, it will run that command with the provided text on stdin and return stdout.
-- Otherwise it raises RuntimeError so callers know no local model is configured.
+- Otherwise it answers with local_infer.py, imported in-process (KLARVIA_USE_SUBPROCESS=1
+  runs it as a separate script instead).
 
 Edit this file to integrate with your actual local model if you have a Python API.
 """
@@ -16,6 +17,18 @@ import sys
 import subprocess
 from typing import Optional
 
+try:
+    from local_infer import infer_local as _infer_local, limit as _limit
+except ImportError:
+    _infer_local = None
+
+# Same flag spelling as ai.main._env_flag.
+_ENV_ON = frozenset({"1", "true", "yes", "on"})
+
+
+def _env_flag(name: str, default: str = "") -> bool:
+    return os.getenv(name, default).strip().lower() in _ENV_ON
+
 
 def infer(text: str, timeout: int = 30) -> str:
     """Run the configured local Klarvia model command and return its output as text.
@@ -27,10 +40,19 @@ def infer(text: str, timeout: int = 30) -> str:
     cmd = os.getenv("KLARVIA_MODEL_CMD")
     # 1) Explicit CLI command (env) takes priority
     if not cmd:
-        # 2) Auto-discover local entry-point script next to this file: local_infer.py
+        use_subprocess = _env_flag("KLARVIA_USE_SUBPROCESS")
+        # 2) local_infer.infer_local, called directly (same output as running the script)
+        if _infer_local is not None and not use_subprocess:
+            try:
+                stripped = (text or "").strip()
+                return _limit(_infer_local(stripped)) if stripped else ""
+            except Exception:
+                # fall through to heuristics
+                pass
+        # 2b) Or run the local_infer.py entry-point script next to this file
         here = os.path.dirname(os.path.abspath(__file__))
         script = os.path.join(here, "local_infer.py")
-        if os.path.isfile(script):
+        if (use_subprocess or _infer_local is None) and os.path.isfile(script):
             try:
                 py = sys.executable or "python"
                 p = subprocess.run([py, script], input=text.encode("utf-8"), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
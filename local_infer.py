@@ -11,8 +11,11 @@ import sys
 import re
 
 
+_SPACES = re.compile(r"\s+")
+
+
 def norm(s: str) -> str:
-    return re.sub(r"\s+", " ", s.strip())
+    return _SPACES.sub(" ", s.strip())
 
 
 def limit(s: str, max_len: int = 480) -> str:
@@ -52,31 +55,39 @@ def fallback(user: str) -> str:
     return f"I hear you: ‘{u}’. Tell me what outcome you want, and I’ll suggest the quickest next step."
 
 
+def reply_stress(_: str) -> str:
+    return (
+        "Try a short breathing break: inhale 4s, hold 4s, exhale 6s for 1–2 minutes. "
+        "A brief walk or a glass of water can also help reset."
+    )
+
+
+# One case-insensitive pass over the text classifies every intent; groups are
+# listed in priority order, which decides when several intents match.
+_INTENT_RE = re.compile(
+    r"(?P<greet>\b(?:hi|hello|hey|good\s*(?:morning|afternoon|evening))\b)"
+    r"|(?P<how>\bhow are you\b)"
+    r"|(?P<thanks>\b(?:thanks|thank you|appreciate it)\b)"
+    r"|(?P<ident>\b(?:who are you|what is klarvia|tell me about you)\b)"
+    r"|(?P<head>\b(?:headache|migraine|head\s*pain)\b)"
+    r"|(?P<stress>\b(?:stress|anxious|anxiety)\b)",
+    re.IGNORECASE,
+)
+_INTENT_REPLY = {
+    "greet": reply_greeting,
+    "how": reply_how_are_you,
+    "thanks": reply_thanks,
+    "ident": reply_who_are_you,
+    "head": reply_headache,
+    "stress": reply_stress,
+}
+
+
 def infer_local(user_text: str) -> str:
-    t = user_text.lower()
-    # Greetings
-    if re.search(r"\b(hi|hello|hey|good\s*(morning|afternoon|evening))\b", t):
-        return reply_greeting(t)
-    # How are you
-    if re.search(r"\bhow are you\b", t):
-        return reply_how_are_you(t)
-    # Thanks
-    if re.search(r"\b(thanks|thank you|appreciate it)\b", t):
-        return reply_thanks(t)
-    # Identity
-    if re.search(r"\b(who are you|what is klarvia|tell me about you)\b", t):
-        return reply_who_are_you(t)
-    # Headache / migraine
-    if re.search(r"\b(headache|migraine|head\s*pain)\b", t):
-        return reply_headache(t)
-    # Simple lifestyle tips
-    if re.search(r"\b(stress|anxious|anxiety)\b", t):
-        return (
-            "Try a short breathing break: inhale 4s, hold 4s, exhale 6s for 1–2 minutes. "
-            "A brief walk or a glass of water can also help reset."
-        )
-    # Fallback
-    return fallback(user_text)
+    intent = min((m.lastgroup for m in _INTENT_RE.finditer(user_text)), key=_INTENT_RE.groupindex.__getitem__, default=None)
+    if intent is None:
+        return fallback(user_text)
+    return _INTENT_REPLY[intent](user_text)
 
 
 def main() -> None:
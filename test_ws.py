@@ -1,5 +1,4 @@
 import asyncio
-import base64
 import sys
 from pathlib import Path
 
@@ -34,20 +33,25 @@ async def run(url: str, in_wav: Path, out_wav: Path) -> None:
     async with websockets.connect(url) as ws:
         print("[ok] connected")
 
-        # Read input WAV and send as base64 text
+        # Read input WAV and send it as one binary frame
         wav_bytes = in_wav.read_bytes()
-        b64 = base64.b64encode(wav_bytes).decode('ascii')
-        await ws.send(b64)
-        print(f"[ok] sent {in_wav} ({len(wav_bytes)} bytes, base64 length {len(b64)})")
+        await ws.send(wav_bytes)
+        print(f"[ok] sent {in_wav} ({len(wav_bytes)} bytes)")
 
-        # Receive messages until we get binary audio, then save and exit
+        # Each binary frame is a complete clip with its own header; keep reading
+        # until the server closes or goes quiet and save each one as output_<n>.
         print("[info] waiting for response audio …")
+        clips = 0
         while True:
-            msg = await ws.recv()
-            if isinstance(msg, (bytes, bytearray)):
-                out_wav.write_bytes(msg)
-                print(f"[ok] received audio -> saved to {out_wav} ({len(msg)} bytes)")
+            try:
+                msg = await asyncio.wait_for(ws.recv(), timeout=5.0 if clips else 60.0)
+            except (asyncio.TimeoutError, websockets.ConnectionClosed):
                 break
+            if isinstance(msg, (bytes, bytearray)):
+                clips += 1
+                path = out_wav.with_name(f"{out_wav.stem}_{clips}{out_wav.suffix}")
+                path.write_bytes(msg)
+                print(f"[ok] received clip {clips} -> saved to {path} ({len(msg)} bytes)")
             else:
                 text = str(msg)
                 print(f"[info] server text: {text}")
@@ -55,7 +59,8 @@ async def run(url: str, in_wav: Path, out_wav: Path) -> None:
                 if "no-speech" in text:
                     print("[warn] Server reported no speech detected in input.")
                     break
-
+        if not clips:
+            print("[warn] no audio received")
 
 if __name__ == "__main__":
     # Defaults
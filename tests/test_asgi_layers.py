@@ -0,0 +1,88 @@
+"""Header behaviour of the pure ASGI layers in ai.main (no server needed)."""
+
+import asyncio
+
+from ai.main import Guard, PermissiveCORS
+
+ORIGIN = b"http://localhost:8080"
+
+
+async def _ok(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _call(app, headers, method="GET", kind="http"):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": kind, "method": method, "path": "/", "headers": headers, "query_string": b""}
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+def _headers(sent):
+    return dict(sent[0].get("headers", ()))
+
+
+def test_cors_reflects_any_origin_without_allow_list():
+    headers = _headers(_call(PermissiveCORS(_ok), [(b"origin", ORIGIN)]))
+    assert headers[b"access-control-allow-origin"] == ORIGIN
+    assert headers[b"access-control-allow-credentials"] == b"true"
+    assert headers[b"vary"] == b"Origin"
+
+
+def test_cors_star_allow_list_sends_wildcard():
+    headers = _headers(_call(PermissiveCORS(_ok, frozenset({b"*"})), [(b"origin", ORIGIN)]))
+    assert headers[b"access-control-allow-origin"] == b"*"
+    assert b"access-control-allow-credentials" not in headers
+
+
+def test_cors_allow_list_reflects_listed_and_skips_others():
+    app = PermissiveCORS(_ok, frozenset({ORIGIN}))
+    assert _headers(_call(app, [(b"origin", ORIGIN)]))[b"access-control-allow-origin"] == ORIGIN
+    other = _call(app, [(b"origin", b"https://evil.example")])
+    assert other[0]["status"] == 200
+    assert b"access-control-allow-origin" not in _headers(other)
+
+
+def test_cors_answers_preflight_without_calling_app():
+    sent = _call(
+        PermissiveCORS(_ok),
+        [(b"origin", ORIGIN), (b"access-control-request-method", b"POST")],
+        method="OPTIONS",
+    )
+    assert sent[0]["status"] == 204
+    headers = _headers(sent)
+    assert headers[b"access-control-allow-origin"] == ORIGIN
+    assert b"access-control-allow-methods" in headers
+    assert sent[1]["body"] == b""
+
+
+def test_guard_without_allow_list_accepts_any_host():
+    assert _call(Guard(_ok), [(b"host", b"192.168.1.5:8001")])[0]["status"] == 200
+
+
+def test_guard_checks_host_without_port_or_brackets():
+    app = Guard(_ok, allowed_hosts=frozenset({b"localhost", b"::1"}))
+    assert _call(app, [(b"host", b"LOCALHOST:8001")])[0]["status"] == 200
+    assert _call(app, [(b"host", b"[::1]:8001")])[0]["status"] == 200
+    assert _call(app, [(b"host", b"evil.example")])[0]["status"] == 400
+    assert _call(app, [])[0]["status"] == 400
+
+
+def test_guard_rejects_unknown_host_websocket_with_close():
+    app = Guard(_ok, allowed_hosts=frozenset({b"localhost"}))
+    sent = _call(app, [(b"host", b"evil.example")], kind="websocket")
+    assert sent == [Guard._WS_REJECT]
+
+
+def test_guard_rejects_oversized_body():
+    sent = _call(Guard(_ok, max_body=10), [(b"content-length", b"11")], method="POST")
+    assert sent[0]["status"] == 413
+    assert _call(Guard(_ok, max_body=10), [(b"content-length", b"10")], method="POST")[0]["status"] == 200
@@ -0,0 +1,26 @@
+"""Intent priority of local_infer: the first matching group wins, not the first match in the text."""
+
+import pytest
+
+from local_infer import _INTENT_REPLY, fallback, infer_local
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Hello", "greet"),
+    ("good  morning!", "greet"),
+    ("How are you?", "how"),
+    ("Thank you so much", "thanks"),
+    ("what is Klarvia", "ident"),
+    ("my head pain is bad", "head"),
+    ("I feel anxious", "stress"),
+    # Several intents: the baseline if-chain order decides.
+    ("I have a headache, hi", "greet"),
+    ("thanks, and how are you", "how"),
+    ("tell me about you, thanks", "thanks"),
+    ("stress gives me a migraine", "head"),
+    ("nothing to see here", None),
+    ("this is high stakes", None),
+])
+def test_intent_priority(text, intent):
+    expected = _INTENT_REPLY[intent](text) if intent else fallback(text)
+    assert infer_local(text) == expected
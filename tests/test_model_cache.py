@@ -0,0 +1,41 @@
+"""The system-prompt KV cache must not change what the model says.
+
+Needs a real Unsloth checkpoint: set MODEL_PATH to run it.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("unsloth")
+
+from ai import model
+
+
+@pytest.fixture(scope="module")
+def loaded():
+    if not os.environ.get("MODEL_PATH"):
+        pytest.skip("MODEL_PATH is not set")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("MODEL_IMPL", "unsloth")
+        model._load_once()
+    if model._strategy != "unsloth" or model._sys_past is None:
+        pytest.skip("Unsloth model or system prompt cache unavailable")
+    return model
+
+
+def test_cached_and_uncached_greedy_replies_match(loaded):
+    inputs = loaded._chat_ids("I keep overthinking everything at night.")
+
+    cached = loaded._generate_ids(inputs, do_sample=False, max_new_tokens=32)
+    assert loaded._sys_past is not None, "cached generate failed and fell back"
+
+    sys_ids, sys_past = loaded._sys_ids, loaded._sys_past
+    loaded._sys_ids = loaded._sys_past = None
+    try:
+        uncached = loaded._generate_ids(inputs, do_sample=False, max_new_tokens=32)
+    finally:
+        loaded._sys_ids, loaded._sys_past = sys_ids, sys_past
+
+    assert cached.tolist() == uncached.tolist()
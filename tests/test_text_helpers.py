@@ -0,0 +1,59 @@
+"""Pure text helpers used by the websocket and model-command paths in ai.main."""
+
+import pytest
+
+from ai.main import _SHELL_SYNTAX, _is_stop_frame, _split_sentences
+
+
+@pytest.mark.parametrize("text", [
+    '{"type":"stop"}',
+    '{"type": "end"}',
+    '{ "type" : "stop", "reason": "button" }',
+])
+def test_stop_frames(text):
+    assert _is_stop_frame(text)
+
+
+@pytest.mark.parametrize("text", [
+    "stop",
+    '{"type":"config"}',
+    '{"type": "stop"',
+    '["stop"]',
+    '{"kind":"stop"}',
+])
+def test_non_stop_frames(text):
+    assert not _is_stop_frame(text)
+
+
+def test_split_sentences_folds_short_pieces_forward():
+    assert _split_sentences("Sure. I can help with that today. Take a breath!") == [
+        "Sure. I can help with that today.",
+        "Take a breath!",
+    ]
+
+
+def test_split_sentences_handles_blank_and_single():
+    assert _split_sentences("   ") == []
+    assert _split_sentences("Just one sentence without an end") == ["Just one sentence without an end"]
+
+
+@pytest.mark.parametrize("cmd", [
+    "python infer.py | tee out.log",
+    "python infer.py > out.txt",
+    "python $MODEL_SCRIPT",
+    "python ~/infer.py",
+    "FOO=1 python infer.py",
+    "  CUDA_VISIBLE_DEVICES=0 python infer.py",
+    "python infer.py # local model",
+])
+def test_shell_syntax_goes_through_the_shell(cmd):
+    assert _SHELL_SYNTAX.search(cmd)
+
+
+@pytest.mark.parametrize("cmd", [
+    "python local_infer.py",
+    "python infer.py --temperature=0.7",
+    "/opt/model/bin/run --max-tokens 200",
+])
+def test_plain_commands_are_execd(cmd):
+    assert not _SHELL_SYNTAX.search(cmd)
@@ -1,6 +1,8 @@
+import io
 import os
+import re
 import time
-from typing import List, Optional
+from typing import BinaryIO, List, Optional, Union
 from queue import Queue
 import subprocess
 import wave
@@ -16,6 +18,27 @@ try:
 except Exception:
     requests = None  # type: ignore
 
+_HTTP = None
+
+
+def get_http_session():
+    """Return the process-wide requests.Session so AI_CHAT_URL calls reuse keep-alive connections."""
+    global _HTTP
+    if _HTTP is None and requests is not None:
+        _HTTP = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        _HTTP.mount("http://", adapter)
+        _HTTP.mount("https://", adapter)
+    return _HTTP
+
+
+def close_http_session() -> None:
+    """Close the shared session (called from the ASGI lifespan shutdown)."""
+    global _HTTP
+    if _HTTP is not None:
+        _HTTP.close()
+        _HTTP = None
+
 # OpenAI SDK v1+
 try:
     from openai import OpenAI
@@ -78,7 +101,7 @@ class ConversationManager:
                 logger.error("AI_CHAT_URL is set but 'requests' is not installed in the environment.")
                 return ""
             try:
-                r = requests.post(self.ai_chat_url, json={"text": content}, timeout=30)
+                r = get_http_session().post(self.ai_chat_url, json={"text": content}, timeout=30)
                 text = ""
                 if r.ok:
                     try:
@@ -128,9 +151,11 @@ class ConversationManager:
 TRANSCRIPTS: "Queue[str]" = Queue()
 
 
-def transcribe_audio(file_path: str) -> str:
-    """Transcribe an audio file using AssemblyAI and enqueue the result.
+def transcribe_audio(file_path: Union[str, bytes, BinaryIO]) -> str:
+    """Transcribe audio using AssemblyAI and enqueue the result.
 
+    Accepts a file path, raw bytes or a binary file object (bytes are uploaded
+    from memory, no temp file needed).
     Returns the transcript text (empty string on failure).
     """
     load_dotenv()
@@ -143,9 +168,12 @@ def transcribe_audio(file_path: str) -> str:
         raise RuntimeError("ASSEMBLYAI_API_KEY is missing in environment.")
     aai.settings.api_key = api_key
 
+    if isinstance(file_path, (bytes, bytearray, memoryview)):
+        file_path = io.BytesIO(file_path)
+
     # Optional: basic file info logging and monitoring
     try:
-        size = os.path.getsize(file_path)
+        size = len(file_path.getbuffer()) if isinstance(file_path, io.BytesIO) else os.path.getsize(file_path)
     except Exception:
         size = None
     try:
@@ -155,6 +183,8 @@ def transcribe_audio(file_path: str) -> str:
             duration = frames / float(rate) if rate else None
     except Exception:
         frames = rate = duration = None
+    if not isinstance(file_path, str):
+        file_path.seek(0)
 
     stage = "AssemblyAI"
     try:
@@ -209,14 +239,15 @@ def _get_conversation_manager() -> ConversationManager:
     return _CONVO
 
 
-def handle_conversation(transcript: str) -> str:
+def handle_conversation(transcript: str, allow_stateful: bool = True) -> str:
     """Local-first conversation handler.
 
     Order:
     1) KLARVIA_MODEL_CMD (subprocess stdin->stdout)
     2) AI_CHAT_URL (HTTP POST {text})
     3) klarvia_voice_bot.infer(text)
-    4) OpenAI via ConversationManager
+    4) OpenAI via ConversationManager (skipped when allow_stateful=False, since it
+       appends to the shared chat history; used for speculative calls on partials)
     Returns "" on total failure (caller may echo transcript or handle otherwise).
     """
     if not isinstance(transcript, str):
@@ -261,7 +292,7 @@ def handle_conversation(transcript: str) -> str:
             if requests is None:
                 logger.error("AI_CHAT_URL is set but 'requests' is not installed.")
             else:
-                r = requests.post(ai_chat_url, json={"text": transcript}, timeout=30)
+                r = get_http_session().post(ai_chat_url, json={"text": transcript}, timeout=30)
                 if r.ok:
                     try:
                         data = r.json()
@@ -308,7 +339,7 @@ def handle_conversation(transcript: str) -> str:
 
     # 4) OpenAI via ConversationManager
     api_key = os.getenv("OPENAI_API_KEY")
-    if api_key:
+    if api_key and allow_stateful:
         stage = "Model_OpenAI"
         try:
             monitoring.stage_start(stage)
@@ -325,24 +356,18 @@ def handle_conversation(transcript: str) -> str:
     return ""
 
 
+_BRAND_VARIANTS = re.compile(
+    r"\b(?:claria|glaria|glarvia|clarvia|clavia|klaria|klavia)\b",
+    re.IGNORECASE,
+)
+
+
 def normalize_transcript(text: str) -> str:
     """Normalize known misrecognitions (e.g., brand name variants) to "Klarvia".
 
-    Applies case-insensitive word-boundary replacements for common variants.
+    Applies case-insensitive word-boundary replacements for common variants,
+    as one precompiled alternation; text without a match is returned as is.
     """
-    if not text:
+    if not text or _BRAND_VARIANTS.search(text) is None:
         return text
-    import re
-    variants = [
-        "claria",
-        "glaria",
-        "glarvia",
-        "clarvia",
-        "clavia",
-        "klaria",
-        "klavia",
-    ]
-    out = text
-    for wrong in variants:
-        out = re.sub(rf"\b{re.escape(wrong)}\b", "Klarvia", out, flags=re.IGNORECASE)
-    return out
+    return _BRAND_VARIANTS.sub("Klarvia", text)
@@ -2,7 +2,7 @@ import io
 import os
 import tempfile
 import time
-from typing import Optional, Tuple, Union
+from typing import Iterator, Optional, Tuple, Union
 
 import numpy as np
 
@@ -239,47 +239,96 @@ def record_audio(
     return path
 
 
-def generate_voice(text: str) -> str:
-    """Generate speech from text using ElevenLabs and save as output.mp3 in the temp folder.
+_ELEVEN_CLIENT = None
 
-    Returns the absolute path to the saved mp3 file.
-    """
+# Model choice; v2 supports multiple languages well
+_ELEVEN_MODEL = "eleven_multilingual_v2"
+
+
+def _eleven_client():
+    """Return a shared ElevenLabs client (one HTTP connection pool per process)."""
+    global _ELEVEN_CLIENT
+    if _ELEVEN_CLIENT is None:
+        # Lazy import to avoid hard dependency for modules not using TTS
+        try:
+            from elevenlabs import ElevenLabs  # type: ignore
+        except Exception as exc:  # pragma: no cover
+            raise RuntimeError("elevenlabs package not available. Install dependencies from requirements.txt") from exc
+
+        api_key = os.getenv("ELEVENLABS_API_KEY")
+        if not api_key:
+            raise RuntimeError("ELEVENLABS_API_KEY is missing in environment.")
+        _ELEVEN_CLIENT = ElevenLabs(api_key=api_key)
+    return _ELEVEN_CLIENT
+
+
+def _tts_text(text) -> str:
     if not isinstance(text, str):
         text = str(text)
     text = text.strip()
     if not text:
         raise ValueError("Text is empty; cannot synthesize.")
+    return text
 
-    # Lazy import to avoid hard dependency for modules not using TTS
-    try:
-        from elevenlabs import ElevenLabs  # type: ignore
-    except Exception as exc:  # pragma: no cover
-        raise RuntimeError("elevenlabs package not available. Install dependencies from requirements.txt") from exc
 
-    api_key = os.getenv("ELEVENLABS_API_KEY")
-    if not api_key:
-        raise RuntimeError("ELEVENLABS_API_KEY is missing in environment.")
+def generate_voice_stream(text: str) -> Iterator[bytes]:
+    """Yield MP3 bytes from ElevenLabs' streaming endpoint as they are synthesized.
+
+    Uses optimize_streaming_latency (ELEVENLABS_STREAM_LATENCY, default 3) so the
+    first bytes arrive after roughly one chunk of synthesis instead of the whole clip.
+    Nothing is written to disk.
+    """
+    text = _tts_text(text)
+    client = _eleven_client()
     voice = os.getenv("ELEVENLABS_VOICE", "Rachel")
+    latency = int(os.getenv("ELEVENLABS_STREAM_LATENCY", "3"))
+    try:
+        audio = client.generate(
+            text=text,
+            voice=voice,
+            model=_ELEVEN_MODEL,
+            stream=True,
+            optimize_streaming_latency=latency,
+            output_format="mp3_44100_128",
+        )
+    except Exception as exc:
+        raise RuntimeError(f"ElevenLabs generate(stream=True) failed: {exc}")
+    for chunk in audio:
+        if chunk:
+            yield bytes(chunk)
 
-    client = ElevenLabs(api_key=api_key)
 
-    # Model choice; v2 supports multiple languages well
-    model = "eleven_multilingual_v2"
+def synthesize_voice(text: str) -> bytes:
+    """Generate speech from text using ElevenLabs and return the MP3 bytes.
+
+    Nothing is written to disk, so concurrent callers can't see each other's audio.
+    """
+    text = _tts_text(text)
+    client = _eleven_client()
+    voice = os.getenv("ELEVENLABS_VOICE", "Rachel")
 
     # Request MP3 output
     try:
-        audio = client.generate(text=text, voice=voice, model=model, output_format="mp3")
+        audio = client.generate(text=text, voice=voice, model=_ELEVEN_MODEL, output_format="mp3")
     except Exception as exc:
         raise RuntimeError(f"ElevenLabs generate() failed: {exc}")
 
     # Normalize to bytes
     if isinstance(audio, (bytes, bytearray)):
-        audio_bytes = bytes(audio)
-    else:
-        try:
-            audio_bytes = b"".join(audio)  # type: ignore[assignment]
-        except TypeError as exc:
-            raise RuntimeError("Unexpected ElevenLabs generate() return type; expected bytes or iterable of bytes.") from exc
+        return bytes(audio)
+    try:
+        return b"".join(audio)  # type: ignore[arg-type]
+    except TypeError as exc:
+        raise RuntimeError("Unexpected ElevenLabs generate() return type; expected bytes or iterable of bytes.") from exc
+
+
+def generate_voice(text: str) -> str:
+    """Generate speech from text using ElevenLabs and save as output.mp3 in the temp folder.
+
+    Returns the absolute path to the saved mp3 file. The path is fixed, so this is
+    only safe for one caller at a time; servers should use synthesize_voice().
+    """
+    audio_bytes = synthesize_voice(text)
 
     tmp_dir = _ensure_temp_dir()
     out_path = os.path.join(tmp_dir, "output.mp3")